@@ -0,0 +1,262 @@
+# backend/history_store.py
+"""
+Persistent, append-only reading and chat history.
+
+Card interpretations and chat turns are appended to a SQLite database in WAL
+mode. Request handlers only put entries on an in-memory queue; a background
+writer thread drains it and inserts each batch in a single transaction, so
+request latency never waits on disk. If the queue is full, entries are
+dropped rather than blocking. Entries older than `retention_days` are deleted
+by a periodic compaction pass. Lookups and forget() are blocking SQLite calls;
+run them off the event loop (asyncio.to_thread).
+
+Exports for analytics run from the command line:
+
+    python history_store.py export --db history.sqlite3 [--since 2026-01-01] [--user ID] [--format jsonl|csv]
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    user_id TEXT NOT NULL,
+    reading_id TEXT,
+    kind TEXT NOT NULL,
+    card_index INTEGER,
+    card TEXT,
+    question TEXT,
+    content TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_reading ON history (reading_id, id);
+CREATE INDEX IF NOT EXISTS history_user ON history (user_id, created_at);
+CREATE INDEX IF NOT EXISTS history_created ON history (created_at);
+-- A card's interpretation is stored once per user and reading, however often it is re-fetched.
+CREATE UNIQUE INDEX IF NOT EXISTS history_card ON history (user_id, reading_id, card_index) WHERE kind = 'card';
+"""
+
+_COLUMNS = ("created_at", "user_id", "reading_id", "kind", "card_index", "card", "question", "content")
+_INSERT = f"INSERT OR IGNORE INTO history ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+class HistoryStore:
+    """Write-behind store for reading and chat history, keyed by reading ID and user."""
+
+    def __init__(self, path: str, retention_days: float = 90.0, batch_size: int = 200,
+                 flush_interval: float = 1.0, max_queue: int = 10000, compact_every: float = 3600.0):
+        self.path = path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_queue)
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._writer_lock = threading.Lock()
+        self._local = threading.local()
+        # Users forgotten recently -> when; the writer drops their older queued entries.
+        self._forgotten: Dict[str, float] = {}
+        self._forget_lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.compacted = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # One connection per thread (lookups run in worker threads) and per process.
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn, self._local.pid = _connect(self.path), os.getpid()
+        return self._local.conn
+
+    def record(self, kind: str, user_id: str, content: str, reading_id: Optional[str] = None,
+               card_index: Optional[int] = None, card: Optional[str] = None, question: Optional[str] = None) -> None:
+        """Queue one history entry. Never blocks; drops the entry if the queue is full."""
+        if self._writer_pid != os.getpid():
+            self._start_writer()
+        try:
+            self._queue.put_nowait((time.time(), user_id, reading_id, kind, card_index, card, question, content))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start_writer(self) -> None:
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+            logging.info("Writing reading history to %s (pid %s)", self.path, self._writer_pid)
+
+    def _write_loop(self) -> None:
+        conn = _connect(self.path)
+        next_compaction = time.monotonic() + self.compact_every
+        while True:
+            batch: List[tuple] = []
+            stopping = False
+            try:
+                entry = self._queue.get(timeout=self.flush_interval)
+                while True:
+                    if entry is None:  # Sentinel from close().
+                        stopping = True
+                        break
+                    batch.append(entry)
+                    if len(batch) >= self.batch_size:
+                        break
+                    entry = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            if batch:
+                self._write_batch(conn, batch)
+            if stopping:
+                conn.close()
+                return
+            if time.monotonic() >= next_compaction:
+                self.compact(conn)
+                next_compaction = time.monotonic() + self.compact_every
+
+    def _write_batch(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        # Held across filter and insert so a concurrent forget() either sees these rows or filters them.
+        with self._forget_lock:
+            if self._forgotten:
+                # entry[0] is created_at, entry[1] the user ID.
+                batch = [e for e in batch if e[0] > self._forgotten.get(e[1], 0.0)]
+                if self._queue.empty():
+                    self._forgotten.clear()
+            if not batch:
+                return
+            try:
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(_INSERT, batch)
+                self.written += len(batch)
+                self.batches += 1
+            except sqlite3.Error as e:
+                self.dropped += len(batch)
+                logging.error("Could not write %s history entries: %s", len(batch), e)
+
+    def compact(self, conn: Optional[sqlite3.Connection] = None) -> int:
+        """Delete entries older than the retention window."""
+        conn = conn or self.conn
+        cutoff = time.time() - self.retention_days * 86400
+        try:
+            deleted = conn.execute("DELETE FROM history WHERE created_at < ?", (cutoff,)).rowcount
+        except sqlite3.Error as e:
+            logging.error("History compaction failed: %s", e)
+            return 0
+        if deleted:
+            self.compacted += deleted
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            logging.info("Compacted %s history entries older than %s days", deleted, self.retention_days)
+        return deleted
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush queued entries and stop the writer."""
+        if self._writer is not None and self._writer_pid == os.getpid():
+            self._queue.put(None)
+            self._writer.join(timeout)
+            self._writer, self._writer_pid = None, None
+
+    def reading(self, user_id: str, reading_id: str) -> List[Dict[str, Any]]:
+        rows = self.conn.execute(
+            "SELECT * FROM history WHERE reading_id = ? AND user_id = ? ORDER BY id",
+            (reading_id, user_id),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def readings(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """The user's most recent readings, newest first."""
+        rows = self.conn.execute(
+            """SELECT reading_id, MIN(created_at) AS started_at, MAX(CASE WHEN kind = 'card' THEN question END) AS question,
+                      SUM(kind = 'card') AS cards, SUM(kind = 'chat') AS chat_turns
+               FROM history WHERE user_id = ? AND reading_id IS NOT NULL
+               GROUP BY reading_id ORDER BY started_at DESC LIMIT ?""",
+            (user_id, limit),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def forget(self, user_id: str) -> int:
+        """Delete everything stored for a user, including entries still waiting in the queue."""
+        with self._forget_lock:
+            self._forgotten[user_id] = time.time()
+            return self.conn.execute("DELETE FROM history WHERE user_id = ?", (user_id,)).rowcount
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "compacted": self.compacted,
+        }
+
+
+def export(path: str, since: Optional[float] = None, user_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream history rows in insertion order, optionally filtered by start time and user."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    query, params = "SELECT * FROM history WHERE created_at >= ?", [since or 0.0]
+    if user_id:
+        query += " AND user_id = ?"
+        params.append(user_id)
+    try:
+        for row in conn.execute(query + " ORDER BY id", params):
+            yield dict(row)
+    finally:
+        conn.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Reading history tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = commands.add_parser("export", help="Write history rows to stdout")
+    export_cmd.add_argument("--db", default=os.getenv("HISTORY_DB_PATH", "history.sqlite3"))
+    export_cmd.add_argument("--since", help="ISO date or datetime (UTC)")
+    export_cmd.add_argument("--user", help="Only this user's entries")
+    export_cmd.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    compact_cmd = commands.add_parser("compact", help="Delete entries older than the retention window")
+    compact_cmd.add_argument("--db", default=os.getenv("HISTORY_DB_PATH", "history.sqlite3"))
+    compact_cmd.add_argument("--retention-days", type=float, default=float(os.getenv("HISTORY_RETENTION_DAYS", "90")))
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        print(HistoryStore(args.db, retention_days=args.retention_days).compact())
+        return
+
+    since = None
+    if args.since:
+        parsed = datetime.fromisoformat(args.since)
+        since = (parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)).timestamp()
+    rows = export(args.db, since, args.user)
+    if args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=("id",) + _COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        for row in rows:
+            sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+# backend/log_pipeline.py
+"""
+Non-blocking, structured logging for the API workers.
+
+Callers only pay for a filter check and a queue put: records are enqueued
+unformatted (log with %-style arguments, not f-strings) and a background
+QueueListener thread formats them as JSON lines and writes them out. Each
+record carries the current trace (request) ID, the reading ID if any, and the
+worker pid.
+
+Rate limiting works per message class, i.e. per logger, level and message
+template: at most `rate_limit` records of a class pass per `window` seconds,
+and the first record after a throttled window reports how many were
+suppressed. INFO and DEBUG records can additionally be sampled. If the queue
+is full, records are dropped rather than blocking the event loop.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Optional, Tuple
+
+from tracing import current_reading_id, current_trace_id
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "pid": record.process,
+            "trace_id": getattr(record, "trace_id", None),
+            "reading_id": getattr(record, "reading_id", None),
+        }
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Per message class rate limiting, plus sampling of INFO and below."""
+
+    def __init__(self, rate_limit: int = 20, window: float = 10.0, info_sample_rate: float = 1.0,
+                 max_classes: int = 5000):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.window = window
+        self.info_sample_rate = info_sample_rate
+        self.max_classes = max_classes
+        # message class -> [window start, records seen, records suppressed]
+        self._windows: Dict[Tuple[str, int, Any], list] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.INFO and self.info_sample_rate < 1.0 and random.random() >= self.info_sample_rate:
+            self.sampled_out += 1
+            return False
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state is not None and state[2]:
+                    record.suppressed = state[2]
+                if state is None and len(self._windows) >= self.max_classes:
+                    self._windows.clear()  # Unbounded templates (e.g. third-party f-strings); start over.
+                state = self._windows[key] = [now, 0, 0]
+            state[1] += 1
+            if state[1] > self.rate_limit:
+                state[2] += 1
+                self.suppressed += 1
+                return False
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Skip QueueHandler's default eager formatting; the listener formats off the hot path.
+        # The trace and reading IDs live in context variables, so they must be captured here.
+        record.trace_id = current_trace_id()
+        record.reading_id = current_reading_id()
+        if _listener_pid != os.getpid():
+            _start_listener()  # Forked (e.g. gunicorn --preload): the writer thread did not survive.
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_handler: Optional[_NonBlockingQueueHandler] = None
+_rate_filter: Optional[RateLimitFilter] = None
+_output: Optional[logging.Handler] = None
+_listener: Optional[QueueListener] = None
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener() -> None:
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+        _listener = QueueListener(_handler.queue, _output, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def _stop_listener() -> None:
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()  # Drains whatever is still queued.
+        _listener, _listener_pid = None, None
+
+
+def configure_logging(level: str = "INFO", fmt: str = "json", rate_limit: int = 20, window: float = 10.0,
+                      info_sample_rate: float = 1.0, queue_size: int = 10000) -> None:
+    """Route the root logger through the background queue. Safe to call more than once."""
+    global _handler, _rate_filter, _output
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    if _handler is not None:
+        return
+    _output = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        _output.setFormatter(JsonFormatter())
+    else:
+        _output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"))
+    _rate_filter = RateLimitFilter(rate_limit, window, info_sample_rate)
+    _handler = _NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    _handler.addFilter(_rate_filter)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    _start_listener()
+    atexit.register(_stop_listener)
+
+
+def snapshot() -> Dict[str, Any]:
+    if _handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "queued": _handler.queue.qsize(),
+        "dropped": _handler.dropped,
+        "suppressed": _rate_filter.suppressed,
+        "sampled_out": _rate_filter.sampled_out,
+    }
@@ -1,17 +1,35 @@
 # /workspaces/ViteaTSRE/backend/main.py
 import os
 import asyncio
+import atexit
+import hashlib
+import hmac
+import secrets
+import uuid
 import logging
-import traceback
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi import Depends, FastAPI, Header, HTTPException, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel, Field
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from openai import AsyncOpenAI, OpenAIError
+import orjson
 from random import sample
-from typing import List, Tuple, Dict, Optional, Any, Union
-from papi_config import PAPI_PERSONA, get_image_prompt_style, get_chat_system_prompt
+from typing import Awaitable, Callable, List, Dict, Optional, Any, Union, Literal
+from typing_extensions import Annotated
+from papi_config import (
+    PAPI_PERSONA, get_image_prompt_style, get_chat_system_prompt,
+    get_fallback_card_text, get_fallback_chat_text,
+)
+from resilience import CircuitBreaker, CircuitOpenError, HedgeBudget, Hedger, LatencyTracker
+from shared_cache import SharedCache, default_cache_path
+from history_store import HistoryStore
+from speculation import SpeculativeStore
+import log_pipeline
+import profiler
+import tracing
+from tracing import begin_trace, span
+from model_router import ModelRouter, default_routing_policies, estimate_tokens, load_routing_config
 
 class TarotError(HTTPException):
     """Base exception for Tarot-related errors."""
@@ -42,14 +60,29 @@ class OpenAIServiceError(TarotError):
             status_code=503
         )
 
-from deck import TAROT_CARDS # Assuming deck.py is in the same directory
+class GenerationFailed(Exception):
+    """Raised by the generators when no real result was produced; `fallback` is what to serve instead."""
+    def __init__(self, fallback: str):
+        super().__init__(fallback)
+        self.fallback = fallback
 
-# Configure basic logging
-logging.basicConfig(level=logging.INFO)  # Changed to INFO for production
+from deck import TAROT_CARDS # Assuming deck.py is in the same directory
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Configure logging: JSON lines written by a background thread, rate limited per message.
+# Log with %-style arguments (not f-strings) so formatting happens off the event loop
+# and the message template identifies the message class for rate limiting.
+log_pipeline.configure_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    fmt=os.getenv("LOG_FORMAT", "json"),
+    rate_limit=int(os.getenv("LOG_RATE_LIMIT", "20")),
+    window=float(os.getenv("LOG_RATE_WINDOW_SECONDS", "10")),
+    info_sample_rate=float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0")),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+)
+
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     logging.error("OPENAI_API_KEY not found in environment variables.")
@@ -62,15 +95,21 @@ if not TAROT_CARDS or len(TAROT_CARDS) < 2:
 # Initialize OpenAI client
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson, used as the app's default response class."""
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
 # Initialize FastAPI app
-app = FastAPI(title="Papi Chispa API")
+app = FastAPI(title="Papi Chispa API", default_response_class=FastJSONResponse)
 
 # Configure CORS
 origins = os.getenv("ALLOWED_ORIGINS", "").split(",")
 if not origins or (len(origins) == 1 and not origins[0]):  # If no origins set, allow all in development
     origins = ["*"]
 
-logging.info(f"Configuring CORS with allowed origins: {origins}")
+logging.info("Configuring CORS with allowed origins: %s", origins)
 
 app.add_middleware(
     CORSMiddleware,
@@ -85,13 +124,169 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
 # --- Constants ---
-DALL_E_MODEL = "dall-e-3"
-GPT_MODEL = "gpt-4" # or "gpt-3.5-turbo"
-
-# --- In-memory cache for chosen cards in a reading ---
+# Defaults for the model router (GPT_MODEL, FAST_GPT_MODEL and DALL_E_MODEL may be set in
+# the environment); per-call choices come from model_router.select().
+DALL_E_MODEL = os.getenv("DALL_E_MODEL", "dall-e-3")
+GPT_MODEL = os.getenv("GPT_MODEL", "gpt-4") # premium model
+FAST_GPT_MODEL = os.getenv("FAST_GPT_MODEL", "gpt-3.5-turbo")
+BATCH_MAX_OPERATIONS = 24
+
+# --- Request size limits ---
+# Enforced by the request models so oversized payloads are rejected before any prompt is built.
+QUESTION_MAX_LENGTH = 500
+CARD_NAME_MAX_LENGTH = 64
+CARD_TEXT_MAX_LENGTH = 4000
+CHAT_MESSAGE_MAX_LENGTH = 2000
+CHAT_HISTORY_MAX_MESSAGES = 40
+MAX_CARDS_PER_READING = 10
+
+# --- Model routing ---
+# Picks a model per call from the route policy (spread size, card index, prompt size,
+# in-flight calls, latency SLO). MODEL_ROUTING_CONFIG may point at a JSON override file.
+model_router = ModelRouter(*load_routing_config(
+    os.getenv("MODEL_ROUTING_CONFIG"),
+    default_routing_policies(GPT_MODEL, FAST_GPT_MODEL, DALL_E_MODEL),
+))
+
+# --- Shared cache for chosen cards and generated content ---
 # This ensures that for a given question and spread size, the same cards are used
-# if multiple calls are made (e.g., for text then image for the same card).
-chosen_readings_cache: dict[Tuple[str, int], List[str]] = {}
+# if multiple calls are made (e.g., for text then image for the same card), even when
+# they land on different workers. All workers on a node share one memory-mapped
+# SQLite store, so card texts and images generated by one worker are reused by the others.
+READING_TTL_SECONDS = float(os.getenv("READING_TTL_SECONDS", str(6 * 3600)))
+# Attempts to store a new draw while another worker holds the cache's write lock.
+DRAW_STORE_ATTEMPTS = 3
+# How long a worker waits for a card another worker is already preparing.
+SHARED_WAIT_SECONDS = float(os.getenv("SHARED_WAIT_SECONDS", "30"))
+shared_cache = SharedCache(
+    os.getenv("SHARED_CACHE_PATH") or default_cache_path(),
+    default_ttl=READING_TTL_SECONDS,
+    # Cache calls run on the event loop, so never wait long for another worker's write lock.
+    busy_timeout=float(os.getenv("SHARED_CACHE_BUSY_TIMEOUT_MS", "50")) / 1000,
+)
+
+# --- Circuit breakers and degraded mode ---
+# One breaker per upstream operation. While a breaker is open, calls fail fast and
+# handlers serve degraded results (cached images, static card art, templated text).
+breakers: Dict[str, CircuitBreaker] = {
+    "chat": CircuitBreaker(
+        "chat",
+        failure_rate_threshold=float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+        slow_call_seconds=float(os.getenv("CHAT_SLOW_CALL_SECONDS", "20")),
+        open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+        call_timeout=float(os.getenv("CHAT_TIMEOUT_SECONDS", "45")),
+    ),
+    "image": CircuitBreaker(
+        "image",
+        failure_rate_threshold=float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5")),
+        slow_call_seconds=float(os.getenv("IMAGE_SLOW_CALL_SECONDS", "40")),
+        open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")),
+        call_timeout=float(os.getenv("IMAGE_TIMEOUT_SECONDS", "90")),
+    ),
+}
+
+# Static card art served by the frontend, used when no cached image is available.
+FALLBACK_CARD_IMAGE_URL = os.getenv("FALLBACK_CARD_IMAGE_URL", "/img/card-back.png")
+# DALL-E URLs expire after about an hour, so cached images are only reused within this window.
+IMAGE_CACHE_TTL_SECONDS = float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(50 * 60)))
+
+# --- Adaptive deadlines and hedged requests ---
+# Chat completions that outlive their rolling p95 latency get one hedged duplicate
+# (on the route's hedge model, or HEDGE_CHAT_MODEL if set); whichever finishes first wins. Hedges draw from a
+# global budget of roughly HEDGE_BUDGET_RATIO of traffic and stop while a breaker is not closed.
+HEDGE_CHAT_MODEL = os.getenv("HEDGE_CHAT_MODEL") or None
+hedger = Hedger(
+    LatencyTracker(),
+    HedgeBudget(ratio=float(os.getenv("HEDGE_BUDGET_RATIO", "0.1"))),
+)
+
+# --- Speculative generation ---
+# When a spread is sampled, every card's text and image is generated in the background
+# so later /api/reading/text and /api/reading/image calls are served from the results.
+# Readings idle for SPECULATIVE_IDLE_SECONDS are treated as abandoned and cancelled.
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "true").lower() in ("1", "true", "yes")
+speculative_store = SpeculativeStore(
+    idle_timeout=float(os.getenv("SPECULATIVE_IDLE_SECONDS", "300")),
+    concurrency=int(os.getenv("SPECULATIVE_CONCURRENCY", "8")),
+)
+
+# --- Tracing ---
+# Spans for each request, tagged with its reading ID, go to an in-memory ring buffer (see /debug/traces/{trace_id})
+# and, if TRACE_EXPORT_PATH is set, to a JSONL file.
+tracing.configure(
+    buffer_size=int(os.getenv("TRACE_BUFFER_SPANS", "5000")),
+    export_path=os.getenv("TRACE_EXPORT_PATH") or None,
+)
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+# --- Reading history ---
+# Card interpretations and chat turns are kept in an append-only SQLite history when
+# HISTORY_ENABLED is set, written behind the request by a background thread. Per the
+# persona's "no memory unless user-enabled" boundary, nothing is stored until the user
+# turns memory on: POST /api/history/token issues a random user ID signed with
+# HISTORY_SECRET, and only requests carrying that token in X-History-Token are stored
+# or can read and erase that user's history. History groups entries by draw ID, not
+# reading ID: asking the same question again after the draw expires is a new reading.
+HISTORY_SECRET = os.getenv("HISTORY_SECRET", "")
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "false").lower() in ("1", "true", "yes")
+if HISTORY_ENABLED and not HISTORY_SECRET:
+    logging.error("HISTORY_ENABLED is set but HISTORY_SECRET is not; reading history stays off.")
+    HISTORY_ENABLED = False
+history_store = HistoryStore(
+    os.getenv("HISTORY_DB_PATH", "history.sqlite3"),
+    retention_days=float(os.getenv("HISTORY_RETENTION_DAYS", "90")),
+) if HISTORY_ENABLED else None
+if history_store is not None:
+    atexit.register(history_store.close)
+PAPI_PERSONA["environment_adaptability"]["memory_placeholder"]["memory_system_ready"] = HISTORY_ENABLED
+
+def sign_history_user(user_id: str) -> str:
+    return hmac.new(HISTORY_SECRET.encode("utf-8"), user_id.encode("utf-8"), hashlib.sha256).hexdigest()
+
+def issue_history_token() -> str:
+    user_id = secrets.token_urlsafe(16)
+    return f"{user_id}.{sign_history_user(user_id)}"
+
+def verify_history_token(token: Optional[str]) -> Optional[str]:
+    """The user ID a history token was issued for, or None if history is off or the token is invalid."""
+    if history_store is None or not token:
+        return None
+    user_id, _, signature = token.partition(".")
+    if not user_id or not hmac.compare_digest(signature, sign_history_user(user_id)):
+        return None
+    return user_id
+
+def history_user_id(x_history_token: Optional[str] = Header(None, max_length=128)) -> Optional[str]:
+    """The user to record history for, or None when history is off or the user has not opted in."""
+    return verify_history_token(x_history_token)
+
+def remember(kind: str, user_id: Optional[str], content: str, **fields: Any) -> None:
+    if history_store is not None and user_id:
+        history_store.record(kind, user_id, content, **fields)
+
+# --- Admin endpoints ---
+# Admin-only endpoints (the profiler and trace viewer) require ADMIN_TOKEN in the X-Admin-Token
+# header and are disabled entirely when ADMIN_TOKEN is not set.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+PROFILE_MAX_SECONDS = 60
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)) -> None:
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+# --- Batch operations ---
+# Upper bound on batch operations running at once, shared by all /api/batch requests.
+batch_semaphore = asyncio.Semaphore(int(os.getenv("BATCH_CONCURRENCY", "12")))
+
+def get_cached_card_image(card_name: str) -> Optional[str]:
+    return shared_cache.get("card_image", card_name)
+
+def get_degraded_card_image(card_name: str) -> str:
+    return get_cached_card_image(card_name) or FALLBACK_CARD_IMAGE_URL
 
 
 # --- API Health and Status Endpoints ---
@@ -102,37 +297,105 @@ async def read_root():
         # Test OpenAI connection with a minimal API call
         await client.chat.completions.create(
             messages=[{"role": "user", "content": "test"}],
-            model="gpt-3.5-turbo",
+            model=model_router.select("health"),
             max_tokens=5
         )
         return {
             "message": "Welcome to Papi Chispa's Tarot API, mi amor! Ask me anything...",
-            "status": "healthy",
-            "openai_connection": "ok"
+            "status": "degraded" if any(b.is_open for b in breakers.values()) else "healthy",
+            "openai_connection": "ok",
+            "circuit_breakers": {name: b.snapshot()["state"] for name, b in breakers.items()},
         }
     except OpenAIError as e:
-        logging.error(f"OpenAI API test failed: {str(e)}")
+        logging.error("OpenAI API test failed: %s", e)
         return {
             "message": "Welcome to Papi Chispa's Tarot API, mi amor! But ay caramba, the spirits are not connecting!",
             "status": "unhealthy",
             "openai_connection": "failed",
+            "circuit_breakers": {name: b.snapshot()["state"] for name, b in breakers.items()},
             "error": str(e)
         }
     except Exception as e:
-        logging.error(f"Unexpected error in health check: {str(e)}")
+        logging.error("Unexpected error in health check: %s", e)
         return {
             "message": "Welcome to Papi Chispa's Tarot API, mi amor! But something mysterious is happening...",
             "status": "error",
             "error": "Internal server error"
         }
 
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe. Does not call OpenAI; reports degraded while any breaker is open."""
+    states = {name: b.snapshot()["state"] for name, b in breakers.items()}
+    return {
+        "status": "degraded" if any(b.is_open for b in breakers.values()) else "ready",
+        "circuit_breakers": states,
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Upstream resilience metrics as JSON."""
+    return {
+        "circuit_breakers": {name: b.snapshot() for name, b in breakers.items()},
+        "shared_cache": shared_cache.snapshot(),
+        "hedging": hedger.snapshot(),
+        "model_routing": model_router.snapshot(),
+        "speculation": speculative_store.snapshot(),
+        "logging": log_pipeline.snapshot(),
+        "history": history_store.snapshot() if history_store is not None else None,
+    }
+
+@app.get("/debug/traces/{trace_id}", dependencies=[Depends(require_admin_token)])
+async def debug_trace(trace_id: str, format: str = "json"):
+    """Span waterfall for a request (its X-Trace-Id) or for every request of a reading ID.
+
+    Admin only. Use ?format=text for plain text.
+    """
+    spans = tracing.get_trace(trace_id)
+    if not spans:
+        raise HTTPException(status_code=404, detail=f"No spans recorded for trace {trace_id}")
+    waterfall = tracing.render_waterfall(spans)
+    if format == "text":
+        return PlainTextResponse("\n".join(waterfall) + "\n")
+    return {
+        "trace_id": trace_id,
+        "span_count": len(spans),
+        "spans": [s.to_dict() for s in spans],
+        "waterfall": waterfall,
+    }
+
+@app.get("/debug/profile", dependencies=[Depends(require_admin_token)])
+async def debug_profile(seconds: float = 10.0, interval_ms: float = 5.0, memory: bool = False, format: str = "collapsed"):
+    """Sample this worker's stacks for `seconds` while it keeps serving traffic.
+
+    Returns flamegraph collapsed stacks as plain text, or JSON (format=json) that
+    also carries the top tracemalloc allocation sites when memory=true.
+    """
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+    if not 1 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="interval_ms must be between 1 and 1000")
+    if format not in ("collapsed", "json"):
+        raise HTTPException(status_code=400, detail="format must be collapsed or json")
+    if memory and format != "json":
+        # Collapsed stacks have nowhere to put allocation sites; don't pay for tracemalloc to discard them.
+        raise HTTPException(status_code=400, detail="memory=true requires format=json")
+    try:
+        result = await asyncio.to_thread(profiler.profile, seconds, interval_ms / 1000, memory)
+    except profiler.ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logging.info("Profiled worker %s for %ss (%s samples)", os.getpid(), seconds, result['samples'])
+    if format == "json":
+        return {**result, "pid": os.getpid(), "stacks": profiler.collapsed(result["stacks"]).splitlines()}
+    return PlainTextResponse(profiler.collapsed(result["stacks"]), headers={"X-Worker-Pid": str(os.getpid())})
+
 # Serve favicon.ico
 @app.get("/favicon.ico", include_in_schema=False)
 async def favicon():
     from fastapi.responses import FileResponse
     favicon_path = os.path.join(STATIC_DIR, "favicon.ico")
     if not os.path.exists(favicon_path):
-        logging.error(f"Favicon not found at expected path: {favicon_path}")
+        logging.error("Favicon not found at expected path: %s", favicon_path)
         # Return a 404 if the file doesn't exist, rather than a 500 from FileResponse
         raise HTTPException(status_code=404, detail=f"Favicon not found at {favicon_path}")
     return FileResponse(favicon_path)
@@ -140,7 +403,7 @@ async def favicon():
 
 # --- Pydantic Models for Request and Response Validation ---
 class ReadingReq(BaseModel):
-    question: str = Field(..., min_length=1, description="The seeker's question for the reading")
+    question: str = Field(..., min_length=1, max_length=QUESTION_MAX_LENGTH, description="The seeker's question for the reading")
     spread: int = Field(..., ge=1, le=6, description="Number of cards to draw (1-6)")
 
     class Config:
@@ -151,18 +414,75 @@ class ReadingReq(BaseModel):
             }
         }
 
+class ReadingTextReq(BaseModel):
+    question: str = Field("", max_length=QUESTION_MAX_LENGTH, description="The seeker's question for the reading")
+    num_cards: int = Field(3, ge=1, le=MAX_CARDS_PER_READING, description="Number of cards to draw")
+
+    class Config:
+        strict = True
+        json_schema_extra = {
+            "example": {
+                "question": "What does my heart truly desire?",
+                "num_cards": 3
+            }
+        }
+
+class CardImageReq(BaseModel):
+    card: str = Field(..., min_length=1, max_length=CARD_NAME_MAX_LENGTH, description="Name of the card to visualize")
+    reading_id: Optional[str] = Field(None, max_length=32, description="Reading the card was drawn in, if known")
+
+    class Config:
+        strict = True
+        json_schema_extra = {
+            "example": {
+                "card": "The High Priestess",
+                "reading_id": "9f4decdc9ba06f1c"
+            }
+        }
+
+class PreviousCard(BaseModel):
+    id: str = Field(..., min_length=1, max_length=CARD_NAME_MAX_LENGTH, description="Card drawn earlier in the reading")
+    text: str = Field("", max_length=CARD_TEXT_MAX_LENGTH, description="Papi's interpretation of that card")
+
+    class Config:
+        strict = True
+
+class ChatMessage(BaseModel):
+    role: Literal["user", "assistant"] = Field(..., description="Who sent the message")
+    content: str = Field(..., max_length=CHAT_MESSAGE_MAX_LENGTH, description="The message text")
+    card_id: Optional[str] = Field(None, max_length=CARD_NAME_MAX_LENGTH, description="Card the message was about")
+
+    class Config:
+        strict = True
+
 class ChatReq(BaseModel):
-    question: str = Field(..., min_length=1, description="The seeker's follow-up question")
-    card_id: str = Field(..., min_length=1, description="The ID of the card being discussed")
+    question: str = Field(..., min_length=1, max_length=QUESTION_MAX_LENGTH, description="The seeker's follow-up question")
+    current_card_id: str = Field(..., min_length=1, max_length=CARD_NAME_MAX_LENGTH, description="The ID of the card being discussed")
+    previous_cards: List[PreviousCard] = Field(default_factory=list, max_length=MAX_CARDS_PER_READING,
+                                               description="Cards drawn before this one")
+    chat_history: List[ChatMessage] = Field(default_factory=list, max_length=CHAT_HISTORY_MAX_MESSAGES,
+                                            description="Chat so far in this reading")
+    reading_id: Optional[str] = Field(None, max_length=32, description="Reading the chat belongs to, if known")
 
     class Config:
+        strict = True
         json_schema_extra = {
             "example": {
                 "question": "What does this card suggest about my career?",
-                "card_id": "THE_LOVERS"
+                "current_card_id": "The Lovers",
+                "previous_cards": [{"id": "The Fool", "text": "A leap into the unknown, mi amor..."}],
+                "chat_history": []
             }
         }
 
+class SessionChatReq(BaseModel):
+    """A chat turn on the /ws/reading channel; cards and history come from the session."""
+    question: str = Field(..., min_length=1, max_length=QUESTION_MAX_LENGTH, description="The seeker's follow-up question")
+    card_index: int = Field(..., ge=0, lt=MAX_CARDS_PER_READING, description="Zero-based index of the card being discussed")
+
+    class Config:
+        strict = True
+
 class IndividualCardDataReq(BaseModel):
     question: str = Field(..., min_length=1, description="The original reading question")
     totalCardsInSpread: int = Field(..., ge=1, le=6, description="Total number of cards in the spread")
@@ -194,6 +514,37 @@ class CardImageOut(BaseModel):
 class ReadingOut(BaseModel):
     cards: List[CardOut] = Field(..., description="List of cards in the reading")
 
+class BatchTextOp(ReadingTextReq):
+    op: Literal["text"]
+    id: Optional[str] = Field(None, max_length=64, description="Client correlation ID echoed in the result")
+    card_index: int = Field(..., ge=0, lt=MAX_CARDS_PER_READING, description="Zero-based index of the card to interpret")
+
+class BatchImageOp(CardImageReq):
+    op: Literal["image"]
+    id: Optional[str] = Field(None, max_length=64, description="Client correlation ID echoed in the result")
+
+class BatchChatOp(ChatReq):
+    op: Literal["chat"]
+    id: Optional[str] = Field(None, max_length=64, description="Client correlation ID echoed in the result")
+
+BatchOp = Annotated[Union[BatchTextOp, BatchImageOp, BatchChatOp], Field(discriminator="op")]
+
+class BatchReq(BaseModel):
+    operations: List[BatchOp] = Field(..., min_length=1, max_length=BATCH_MAX_OPERATIONS,
+                                      description="Operations to run concurrently")
+    stream: bool = Field(False, description="Stream NDJSON results as each operation completes")
+
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "operations": [
+                    {"op": "text", "id": "t0", "question": "What path should I take?", "num_cards": 3, "card_index": 0},
+                    {"op": "image", "id": "i0", "card": "The Lovers"},
+                ],
+                "stream": False
+            }
+        }
+
 class CardReq(BaseModel):
     card_id: str = Field(..., min_length=1, description="The ID of the card to generate an image for")
 
@@ -206,82 +557,331 @@ class CardReq(BaseModel):
 
 
 # --- Helper function to get or sample cards for a reading ---
+def make_reading_id(question: str, total_cards: int) -> str:
+    """Stable ID for the reading drawn for a question and spread size."""
+    return hashlib.sha1(f"{total_cards}:{question}".encode("utf-8")).hexdigest()[:16]
+
+def get_reading_draw(question: str, total_cards: int) -> Dict[str, Any]:
+    """The cards drawn for this question and spread size, with the draw's `draw_id`.
+
+    The reading ID repeats when the same question is asked again after the draw
+    expires; the draw ID is random, so history recorded under it never mixes draws.
+    """
+    with span("get_chosen_cards", spread=total_cards):
+        reading_id = make_reading_id(question, total_cards)
+        cached_draw = shared_cache.get("reading_draw", reading_id)
+        if cached_draw is not None:
+            logging.info("Cache hit for reading %s (%s cards)", reading_id, total_cards)
+            return cached_draw
+        else:
+            if total_cards > len(TAROT_CARDS):
+                logging.error("Requested %s cards, but only %s unique cards are available.", total_cards, len(TAROT_CARDS))
+                raise HTTPException(status_code=400, detail="Not enough unique cards available for the requested spread size.")
+            chosen_cards = sample(TAROT_CARDS, total_cards) # TAROT_CARDS is a list, sample directly
+            draw = {"cards": chosen_cards, "draw_id": uuid.uuid4().hex[:16]}
+            for _ in range(DRAW_STORE_ATTEMPTS):
+                if shared_cache.add("reading_draw", reading_id, draw):
+                    break
+                # Another worker drew this reading first; everyone uses its cards.
+                stored_draw = shared_cache.get("reading_draw", reading_id)
+                if stored_draw is not None:
+                    return stored_draw
+            else:
+                # Unsaved cards would not match the next call's, so never hand them out.
+                logging.warning("Could not store the draw for reading %s; the shared cache is busy", reading_id)
+                raise TarotError("Ay, the cards are still shuffling, mi cielo. Try again in a moment.", status_code=503)
+            logging.info("Sampled cards for reading %s (%s cards): %s", reading_id, total_cards, chosen_cards)
+            if SPECULATIVE_GENERATION and not any(b.is_open for b in breakers.values()):
+                shared_cache.set("speculating", reading_id, os.getpid(), ttl=speculative_store.idle_timeout)
+                speculative_store.schedule(
+                    reading_id,
+                    question,
+                    chosen_cards,
+                    lambda card, index: speculate("card_text", f"{reading_id}:{index}", lambda: generate_shared_card_text(
+                        reading_id, card, question, total_cards, index)),
+                    lambda card: speculate("reading_image", f"{reading_id}:{card}", lambda: generate_shared_card_image(
+                        reading_id, card)),
+                    on_finished=lambda: shared_cache.delete("speculating", reading_id),
+                )
+            return draw
+
 def get_chosen_cards_for_reading(question: str, total_cards: int) -> List[str]:
-    cache_key = (question, total_cards)
-    if cache_key in chosen_readings_cache:
-        logging.info(f"Cache hit for reading '{question}' ({total_cards} cards).")
-        return chosen_readings_cache[cache_key]
-    else:
-        if total_cards > len(TAROT_CARDS):
-            logging.error(f"Requested {total_cards} cards, but only {len(TAROT_CARDS)} unique cards are available.")
-            raise HTTPException(status_code=400, detail="Not enough unique cards available for the requested spread size.")
-        chosen_cards = sample(TAROT_CARDS, total_cards) # TAROT_CARDS is a list, sample directly
-        chosen_readings_cache[cache_key] = chosen_cards
-        logging.info(f"Sampled cards for reading '{question}' ({total_cards} cards): {chosen_cards}")
-        return chosen_cards
+    return get_reading_draw(question, total_cards)["cards"]
+
+def current_draw_id(reading_id: Optional[str]) -> Optional[str]:
+    """ID of the live draw for a reading, or None if there is none (e.g. it expired)."""
+    draw = shared_cache.get("reading_draw", reading_id) if reading_id else None
+    return draw["draw_id"] if draw else None
+
 
 # --- OpenAI Interaction Helper Functions ---
+async def routed_completion(route: str, model: str, **kwargs: Any) -> Any:
+    """Chat completion on `model`, recorded in the router stats and guarded by the chat breaker."""
+    with span("upstream", route=route, model=model), model_router.observe(route, model) as observation:
+        response = await breakers["chat"].call(lambda: client.chat.completions.create(model=model, **kwargs))
+        observation.usage = getattr(response, "usage", None)
+        return response
+
+async def routed_image(model: str, **kwargs: Any) -> Any:
+    """Image generation on `model`, recorded in the router stats and guarded by the image breaker."""
+    with span("upstream", route="image", model=model), model_router.observe("image", model):
+        return await breakers["image"].call(lambda: client.images.generate(model=model, **kwargs))
+
 async def generate_text_for_card(card_name: str, question_context: str, total_cards_in_spread: int, card_number_in_spread: int) -> str:
-    logging.info(f"Generating chat response for card: {card_name}")
-    prompt_content = (
-        f"Card: {card_name} (This is card {card_number_in_spread + 1} of a {total_cards_in_spread}-card spread.)\n"
-        f"User question: {question_context}\n"
-        "Respond in Papi's style."
-    )
-    try:
-        chat_completion = await client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": get_chat_system_prompt()},
-                {"role": "user", "content": prompt_content},
-            ],
-            model=GPT_MODEL,
-            max_tokens=350,
-            temperature=0.9,
+    """Generate one card's text. Raises GenerationFailed carrying the text to show if that fails."""
+    with span("generate_text", card=card_name, index=card_number_in_spread):
+        logging.info("Generating chat response for card: %s", card_name)
+        prompt_content = (
+            f"Card: {card_name} (This is card {card_number_in_spread + 1} of a {total_cards_in_spread}-card spread.)\n"
+            f"User question: {question_context}\n"
+            "Respond in Papi's style."
         )
-        if chat_completion.choices and chat_completion.choices[0].message:
-            text_content = chat_completion.choices[0].message.content
-            logging.info(f"Successfully generated text for {card_name}")
-            return text_content.strip() if text_content else "Papi Chispa is feeling a bit shy with the words right now, mi amor."
-        return "Papi Chispa's words are lost in the stars for this one..."
-    except OpenAIError as e:
-        logging.error(f"OpenAI API error generating text for {card_name}: {e}")
-        return f"Ay, an OpenAI hiccup! Papi Chispa can't quite channel the spirits for {card_name}. Error: {str(e)}"
-    except Exception as e:
-        logging.error(f"Unexpected error generating text for {card_name}: {e}\n{traceback.format_exc()}")
-        return f"A mysterious silence from the spirits for {card_name}..."
+        messages = [
+            {"role": "system", "content": get_chat_system_prompt()},
+            {"role": "user", "content": prompt_content},
+        ]
+        model = model_router.select(
+            "card_text",
+            spread=total_cards_in_spread,
+            card_index=card_number_in_spread,
+            prompt_tokens=estimate_tokens(messages[0]["content"], prompt_content),
+        )
+
+        def completion(model: str):
+            return lambda: routed_completion("card_text", model, messages=messages, max_tokens=350, temperature=0.9)
+
+        try:
+            chat_completion = await hedger.run(
+                "card_text",
+                completion(model),
+                completion(HEDGE_CHAT_MODEL or model_router.hedge_model("card_text", model)),
+                breaker=breakers["chat"],
+                max_deadline=breakers["chat"].call_timeout,
+            )
+        except CircuitOpenError:
+            logging.info("Chat circuit open, serving templated text for %s", card_name)
+            raise GenerationFailed(get_fallback_card_text(card_name, card_number_in_spread, total_cards_in_spread))
+        except (OpenAIError, asyncio.TimeoutError) as e:
+            logging.error("OpenAI API error generating text for %s: %r", card_name, e)
+            raise GenerationFailed(get_fallback_card_text(card_name, card_number_in_spread, total_cards_in_spread)) from e
+        except Exception as e:
+            logging.error("Unexpected error generating text for %s: %s", card_name, e, exc_info=True)
+            raise GenerationFailed(f"A mysterious silence from the spirits for {card_name}...") from e
+
+        if not chat_completion.choices or not chat_completion.choices[0].message:
+            raise GenerationFailed("Papi Chispa's words are lost in the stars for this one...")
+        text_content = (chat_completion.choices[0].message.content or "").strip()
+        if not text_content:
+            raise GenerationFailed("Papi Chispa is feeling a bit shy with the words right now, mi amor.")
+        logging.info("Successfully generated text for %s", card_name)
+        return text_content
 
 async def generate_image_for_card(card_name: str) -> str:
-    logging.info(f"Generating image for card: {card_name}")
-    style_guide = get_image_prompt_style()
-    try:
-        prompt = f"""Tarot card illustration of {card_name}.
+    """Generate a card image URL. Raises GenerationFailed carrying a degraded image (or "") if that fails."""
+    with span("generate_image", card=card_name):
+        logging.info("Generating image for card: %s", card_name)
+        style_guide = get_image_prompt_style()
+        try:
+            prompt = f"""Tarot card illustration of {card_name}.
 {style_guide}
 Make it emotionally evocative and dramatically lit."""
 
-        img = await client.images.generate(
-            model=DALL_E_MODEL,
-            prompt=prompt,
-            size="1024x1024",
-            n=1,
-        )
-        if img and img.data and len(img.data) > 0 and img.data[0] and img.data[0].url:
-            logging.info(f"Successfully generated image URL for {card_name}")
-            return img.data[0].url
-        return ""
+            img = await routed_image(
+                model_router.select("image"),
+                prompt=prompt,
+                size="1024x1024",
+                n=1,
+            )
+        except CircuitOpenError:
+            logging.info("Image circuit open, serving degraded image for %s", card_name)
+            raise GenerationFailed(get_degraded_card_image(card_name))
+        except (OpenAIError, asyncio.TimeoutError) as e:
+            logging.error("OpenAI API error generating image for %s: %r", card_name, e)
+            raise GenerationFailed(get_degraded_card_image(card_name)) from e
+        except Exception as e:
+            logging.error("Unexpected error generating image for %s: %s", card_name, e, exc_info=True)
+            raise GenerationFailed("") from e
+
+        if not (img and img.data and img.data[0] and img.data[0].url):
+            raise GenerationFailed("")
+        logging.info("Successfully generated image URL for %s", card_name)
+        shared_cache.set("card_image", card_name, img.data[0].url, ttl=IMAGE_CACHE_TTL_SECONDS)
+        return img.data[0].url
+
+async def generate_shared_card_text(reading_id: str, card_name: str, question: str, total_cards: int, index: int) -> str:
+    """Generate card text and share it with the other workers. Raises GenerationFailed."""
+    text = await generate_text_for_card(card_name, question, total_cards, index)
+    shared_cache.set("card_text", f"{reading_id}:{index}", text)
+    return text
+
+async def generate_shared_card_image(reading_id: str, card_name: str) -> str:
+    """Generate a card image and share it with the other workers. Raises GenerationFailed."""
+    image_url = await generate_image_for_card(card_name)
+    shared_cache.set("reading_image", f"{reading_id}:{card_name}", image_url, ttl=IMAGE_CACHE_TTL_SECONDS)
+    return image_url
+
+async def speculate(namespace: str, key: str, generate: Callable[[], Awaitable[str]]) -> str:
+    """Run speculative generation, marking the entry as failed for waiting workers if it produces nothing."""
+    try:
+        return await generate()
+    except BaseException:
+        shared_cache.set("speculation_failed", f"{namespace}:{key}", os.getpid(), ttl=SHARED_WAIT_SECONDS)
+        raise
+
+def worker_alive(pid: int) -> bool:
+    # The shared cache is node-local, so the owner's pid is meaningful here.
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def is_prepared_elsewhere(reading_id: str) -> bool:
+    """True if another live worker is still speculatively preparing this reading."""
+    owner = shared_cache.get("speculating", reading_id)
+    return owner is not None and owner != os.getpid() and worker_alive(owner)
+
+async def wait_for_prepared(namespace: str, key: str, reading_id: str) -> Optional[str]:
+    """Wait for an entry another worker is preparing; give up once it has failed or stopped preparing."""
+    def given_up() -> bool:
+        return (shared_cache.get("speculation_failed", f"{namespace}:{key}") is not None
+                or not is_prepared_elsewhere(reading_id))
+    return await shared_cache.wait_for(namespace, key, SHARED_WAIT_SECONDS, give_up=given_up)
+
+async def get_card_text(reading_id: str, card_name: str, question: str, total_cards: int, index: int) -> str:
+    """Shared or speculatively prepared card text if usable, otherwise generate it now."""
+    key = f"{reading_id}:{index}"
+    text = shared_cache.get("card_text", key)
+    if text:
+        return text
+    text = await speculative_store.text(reading_id, index)
+    if text:
+        return text
+    if is_prepared_elsewhere(reading_id):
+        text = await wait_for_prepared("card_text", key, reading_id)
+        if text:
+            return text
+    try:
+        return await generate_shared_card_text(reading_id, card_name, question, total_cards, index)
+    except GenerationFailed as e:
+        return e.fallback
+
+async def get_card_image_url(card_name: str, reading_id: Optional[str] = None) -> str:
+    """Shared or speculatively prepared card image if usable, otherwise generate it now."""
+    if reading_id:
+        key = f"{reading_id}:{card_name}"
+        image_url = shared_cache.get("reading_image", key)
+    else:
+        # Not tied to a reading: any worker's recent image of this card will do.
+        image_url = get_cached_card_image(card_name)
+    if image_url:
+        return image_url
+    image_url = await speculative_store.image(card_name, reading_id)
+    if image_url:
+        return image_url
+    if reading_id and is_prepared_elsewhere(reading_id):
+        image_url = await wait_for_prepared("reading_image", key, reading_id)
+        if image_url:
+            return image_url
+    try:
+        if reading_id:
+            return await generate_shared_card_image(reading_id, card_name)
+        return await generate_image_for_card(card_name)
+    except GenerationFailed as e:
+        return e.fallback
+
+async def card_text_result(question: str, num_cards: int, card_index: int) -> Dict[str, Any]:
+    """Text for one card of the reading drawn for this question and spread size."""
+    draw = get_reading_draw(question, num_cards)
+    chosen_cards = draw["cards"]
+    if not 0 <= card_index < len(chosen_cards):
+        raise TarotError(f"Mi amor, this reading only has {len(chosen_cards)} cards.")
+    reading_id = make_reading_id(question, num_cards)
+    card = chosen_cards[card_index]
+    try:
+        text = await get_card_text(reading_id, card, question, num_cards, card_index)
     except OpenAIError as e:
-        logging.error(f"OpenAI API error generating image for {card_name}: {e}")
-        return ""
-    except Exception as e:
-        logging.error(f"Unexpected error generating image for {card_name}: {e}\n{traceback.format_exc()}")
-        return ""
+        logging.error("OpenAI API error generating text for card %s: %s", card, e)
+        raise OpenAIServiceError(f"reading for card {card}")
+    return {"card": card, "text": text, "reading_id": reading_id, "draw_id": draw["draw_id"]}
+
+async def card_image_result(card_name: Optional[str], reading_id: Optional[str] = None) -> Dict[str, Any]:
+    """Validate a card and get its image URL, preferring prepared or shared results."""
+    if not card_name:
+        raise TarotError("Mi amor, I need to know which card to visualize for you.")
+
+    if card_name not in [card.strip() for card in TAROT_CARDS]:
+        raise CardNotFoundError(card_name)
+
+    try:
+        # Generate image URL using shared helper
+        image_url = await get_card_image_url(card_name, reading_id)
+
+        if not image_url:
+            raise OpenAIServiceError("image generation")
+
+        logging.info("Image generated for %s: %s", card_name, image_url)
+        return {"imageUrl": image_url}
+
+    except OpenAIError as e:
+        logging.error("OpenAI API error generating image for card %s: %s", card_name, e)
+        raise OpenAIServiceError(f"image for {card_name}")
+
+async def chat_reply(question: str, current_card_id: str, previous_cards: List[Dict[str, str]],
+                     chat_history: List[Dict[str, str]]) -> Dict[str, Any]:
+    """Validate a chat turn and get Papi's reply for it."""
+    if not question:
+        raise TarotError("Mi amor, I need your question to channel the spirits.")
+    if not current_card_id:
+        raise TarotError("Which card are we discussing, mi cielo?")
+
+    if current_card_id not in [card.strip() for card in TAROT_CARDS]:
+        raise CardNotFoundError(current_card_id)
+
+    # Format the context for the AI
+    context = build_chat_context(question, current_card_id, previous_cards, chat_history)
+
+    messages = [
+        {"role": "system", "content": context},
+        {"role": "user", "content": question}
+    ]
+    model = model_router.select("chat", spread=len(previous_cards) + 1,
+                                prompt_tokens=estimate_tokens(context, question))
+
+    def completion(model: str):
+        return lambda: routed_completion("chat", model, messages=messages, temperature=0.7, max_tokens=300)
+
+    try:
+        # Call OpenAI API with the enhanced context, hedging if it runs long
+        response = await hedger.run(
+            "chat",
+            completion(model),
+            completion(HEDGE_CHAT_MODEL or model_router.hedge_model("chat", model)),
+            breaker=breakers["chat"],
+            max_deadline=breakers["chat"].call_timeout,
+        )
+
+        if not response.choices or not response.choices[0].message:
+            raise OpenAIServiceError("chat response")
+
+        return {"text": response.choices[0].message.content}
+
+    except CircuitOpenError:
+        logging.info("Chat circuit open, serving templated chat reply")
+        return {"text": get_fallback_chat_text(current_card_id), "degraded": True}
+    except (OpenAIError, asyncio.TimeoutError) as e:
+        logging.error("OpenAI API error in chat: %r", e)
+        raise OpenAIServiceError("chat response")
 
 # --- API Endpoints ---
 @app.post("/image") # Standalone image generation, not tied to a reading context
 async def create_image(req: CardReq):
-    logging.info(f"Request to /image for card_id: {req.card_id}")
+    logging.info("Request to /image for card_id: %s", req.card_id)
     try:
-        img = await client.images.generate(
-            model=DALL_E_MODEL,
+        img = await routed_image(
+            model_router.select("image"),
             prompt=f"Tarot card illustration of {req.card_id} in neon retro style",
             size="1024x1024", # Changed to a supported DALL-E 3 size
             n=1,
@@ -290,125 +890,112 @@ async def create_image(req: CardReq):
             return {"imageUrl": img.data[0].url}
         else:
             raise HTTPException(status_code=500, detail="Image generation failed to return a URL.")
-    except OpenAIError as e:
-        logging.error(f"OpenAI API error in /image endpoint for {req.card_id}: {e}")
+    except CircuitOpenError:
+        return {"imageUrl": get_degraded_card_image(req.card_id), "degraded": True}
+    except HTTPException:
+        raise
+    except (OpenAIError, asyncio.TimeoutError) as e:
+        logging.error("OpenAI API error in /image endpoint for %s: %s", req.card_id, e)
         raise HTTPException(status_code=503, detail=f"OpenAI Service unavailable or error: {str(e)}")
     except Exception as e:
-        logging.error(f"Unexpected error in /image endpoint for {req.card_id}: {e}\n{traceback.format_exc()}")
+        logging.error("Unexpected error in /image endpoint for %s: %s", req.card_id, e, exc_info=True)
         raise HTTPException(status_code=500, detail="Internal server error during image generation.")
 
 
 @app.post("/reading", response_model=ReadingOut)
-async def create_reading(req: ReadingReq):
-    logging.info(f"Request to /reading for question: '{req.question}' with spread size: {req.spread}")
-    if req.spread <= 0:
-        raise HTTPException(status_code=400, detail="Spread size must be positive.")
-
-    chosen_card_names = get_chosen_cards_for_reading(req.question, req.spread)
-
-    async def generate_card_data(name: str, index: int) -> CardOut:
-        try:
-            # Use asyncio.gather to fetch image and text concurrently for each card
-            image_url, text_content = await asyncio.gather(
-                generate_image_for_card(name),
-                generate_text_for_card(name, req.question, req.spread, index)
-            )
-            return CardOut(id=name, imageUrl=image_url, text=text_content)
-        except Exception as e:
-            logging.error(f"Error processing card {name} in /reading: {e}\n{traceback.format_exc()}")
-            # Return a card with error indicators
-            return CardOut(id=name, imageUrl="", text=f"Error fetching details for {name}.")
-
-    card_tasks = [generate_card_data(name, i) for i, name in enumerate(chosen_card_names)]
-    results = await asyncio.gather(*card_tasks, return_exceptions=False) # Let individual errors be handled within generate_card_data
-
-    return ReadingOut(cards=results)
+async def create_reading(req: ReadingReq, response: Response):
+    response.headers["X-Trace-Id"] = trace_id = new_trace_id()
+    begin_trace(trace_id, make_reading_id(req.question, req.spread))
+    with span("handler", route="/reading"):
+        logging.info("Request to /reading (question length %s) with spread size: %s", len(req.question), req.spread)
+        if req.spread <= 0:
+            raise HTTPException(status_code=400, detail="Spread size must be positive.")
+
+        chosen_card_names = get_chosen_cards_for_reading(req.question, req.spread)
+        reading_id = make_reading_id(req.question, req.spread)
+
+        async def generate_card_data(name: str, index: int) -> CardOut:
+            try:
+                # Use asyncio.gather to fetch image and text concurrently for each card
+                image_url, text_content = await asyncio.gather(
+                    get_card_image_url(name, reading_id),
+                    get_card_text(reading_id, name, req.question, req.spread, index)
+                )
+                return CardOut(id=name, imageUrl=image_url, text=text_content)
+            except Exception as e:
+                logging.error("Error processing card %s in /reading: %s", name, e, exc_info=True)
+                # Return a card with error indicators
+                return CardOut(id=name, imageUrl="", text=f"Error fetching details for {name}.")
+
+        card_tasks = [generate_card_data(name, i) for i, name in enumerate(chosen_card_names)]
+        results = await asyncio.gather(*card_tasks, return_exceptions=False) # Let individual errors be handled within generate_card_data
+
+        return ReadingOut(cards=results)
 
 
 @app.post("/api/reading/text")
-async def get_reading(request: Request):
+async def get_reading(req: ReadingTextReq, response: Response, user_id: Optional[str] = Depends(history_user_id)):
     """Generate a tarot reading with enhanced error handling."""
-    try:
-        data = await request.json()
-        num_cards = data.get("num_cards", 3)
-        question = data.get("question", "")
-
-        if not isinstance(num_cards, int):
-            raise TarotError("Mi amor, I need a valid number of cards to draw.")
-        
-        if num_cards <= 0:
-            raise SpreadSizeError("I cannot do a reading with no cards, mi cielo.")
-        
-        if num_cards > 10:
-            raise SpreadSizeError(f"Ten cards is my limit for a clear reading, mi amor. You asked for {num_cards}.")
-
+    response.headers["X-Trace-Id"] = trace_id = new_trace_id()
+    begin_trace(trace_id, make_reading_id(req.question, req.num_cards))
+    with span("handler", route="/api/reading/text"):
         try:
-            # Get randomly chosen cards for the reading
-            chosen_cards = get_chosen_cards_for_reading(question, num_cards)
+            num_cards = req.num_cards
+            question = req.question
+
+            try:
+                # Get randomly chosen cards for the reading
+                draw = get_reading_draw(question, num_cards)
+                chosen_cards = draw["cards"]
+                reading_id = make_reading_id(question, num_cards)
             
-            # Generate text for each card
-            card_texts = []
-            for card in chosen_cards:
-                try:
-                    text = await generate_text_for_card(card, question, num_cards, chosen_cards.index(card))
-                    card_texts.append({"card": card, "text": text})
-                except OpenAIError as e:
-                    logging.error(f"OpenAI API error generating text for card {card}: {str(e)}")
-                    raise OpenAIServiceError(f"reading for card {card}")
-
-            return {"cards": card_texts}
-
-        except OpenAIError as e:
-            logging.error(f"OpenAI API error in reading: {str(e)}")
-            raise OpenAIServiceError("reading")
-
-    except TarotError as e:
-        # Already formatted with Papi's voice
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error in reading endpoint: {str(e)}")
-        raise TarotError(
-            "Ay caramba! The cards are being mysterious. Let's try again, mi amor.",
-            status_code=500
-        )
+                # Generate text for each card
+                card_texts = []
+                for card in chosen_cards:
+                    try:
+                        index = chosen_cards.index(card)
+                        text = await get_card_text(reading_id, card, question, num_cards, index)
+                        card_texts.append({"card": card, "text": text})
+                        remember("card", user_id, text, reading_id=draw["draw_id"], card_index=index, card=card, question=question)
+                    except OpenAIError as e:
+                        logging.error("OpenAI API error generating text for card %s: %s", card, e)
+                        raise OpenAIServiceError(f"reading for card {card}")
+
+                return {"cards": card_texts, "reading_id": reading_id, "draw_id": draw["draw_id"]}
+
+            except OpenAIError as e:
+                logging.error("OpenAI API error in reading: %s", e)
+                raise OpenAIServiceError("reading")
+
+        except TarotError as e:
+            # Already formatted with Papi's voice
+            raise e
+        except Exception as e:
+            logging.error("Unexpected error in reading endpoint: %s", e)
+            raise TarotError(
+                "Ay caramba! The cards are being mysterious. Let's try again, mi amor.",
+                status_code=500
+            )
 
 
 @app.post("/api/reading/image")
-async def get_card_image(request: Request):
+async def get_card_image(req: CardImageReq, response: Response):
     """Generate an image for a card with enhanced error handling."""
-    try:
-        data = await request.json()
-        card_name = data.get("card")
-        
-        if not card_name:
-            raise TarotError("Mi amor, I need to know which card to visualize for you.")
-
-        if card_name not in [card.strip() for card in TAROT_CARDS]:
-            raise CardNotFoundError(card_name)
-
+    response.headers["X-Trace-Id"] = trace_id = new_trace_id()
+    begin_trace(trace_id, req.reading_id)
+    with span("handler", route="/api/reading/image", card=req.card):
         try:
-            # Generate image URL using shared helper
-            image_url = await generate_image_for_card(card_name)
-
-            if not image_url:
-                raise OpenAIServiceError("image generation")
-
-            logging.info(f"Image generated for {card_name}: {image_url}")
-            return {"imageUrl": image_url}
+            return await card_image_result(req.card, req.reading_id)
 
-        except OpenAIError as e:
-            logging.error(f"OpenAI API error generating image for card {card_name}: {str(e)}")
-            raise OpenAIServiceError(f"image for {card_name}")
-
-    except TarotError as e:
-        # Already formatted with Papi's voice
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error in image generation endpoint: {str(e)}")
-        raise TarotError(
-            "Ay, the spirits are having trouble painting this vision. Let's try again, mi amor.",
-            status_code=500
-        )
+        except TarotError as e:
+            # Already formatted with Papi's voice
+            raise e
+        except Exception as e:
+            logging.error("Unexpected error in image generation endpoint: %s", e)
+            raise TarotError(
+                "Ay, the spirits are having trouble painting this vision. Let's try again, mi amor.",
+                status_code=500
+            )
 
 if __name__ == "__main__":
     import uvicorn
@@ -420,36 +1007,134 @@ if __name__ == "__main__":
 
     # Ensure static directory exists for local direct execution
     if not os.path.exists(STATIC_DIR):
-        logging.info(f"Creating static directory for local dev: {STATIC_DIR}")
+        logging.info("Creating static directory for local dev: %s", STATIC_DIR)
         os.makedirs(STATIC_DIR)
     # Ensure placeholder favicon exists for local direct execution
     local_favicon_path = os.path.join(STATIC_DIR, "favicon.ico")
     if not os.path.exists(local_favicon_path):
-        logging.info(f"Creating placeholder favicon for local dev: {local_favicon_path}")
+        logging.info("Creating placeholder favicon for local dev: %s", local_favicon_path)
         with open(local_favicon_path, "a") as f: pass # Create an empty file
 
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
 @app.post("/api/chat")
-async def chat(request: Request):
+async def chat(req: ChatReq, response: Response, user_id: Optional[str] = Depends(history_user_id)):
     """Handle chat interactions with enhanced error handling and Papi's personality."""
-    try:
-        data = await request.json()
-        question = data.get("question")
-        current_card_id = data.get("current_card_id")
-        previous_cards = data.get("previous_cards", [])
-        chat_history = data.get("chat_history", [])
+    response.headers["X-Trace-Id"] = trace_id = new_trace_id()
+    begin_trace(trace_id, req.reading_id)
+    with span("handler", route="/api/chat", card=req.current_card_id):
+        try:
+            reply = await chat_reply(
+                req.question,
+                req.current_card_id,
+                [card.model_dump() for card in req.previous_cards],
+                [message.model_dump() for message in req.chat_history],
+            )
+            remember("chat", user_id, reply["text"], reading_id=current_draw_id(req.reading_id), card=req.current_card_id,
+                     question=req.question)
+            return reply
+
+        except TarotError as e:
+            # Already formatted with Papi's voice
+            raise e
+        except Exception as e:
+            logging.error("Unexpected error in chat endpoint: %s", e)
+            raise TarotError(
+                "Ay, something mysterious is blocking our connection. Try again, mi amor.",
+                status_code=500
+            )
 
-        if not question:
-            raise TarotError("Mi amor, I need your question to channel the spirits.")
-        if not current_card_id:
-            raise TarotError("Which card are we discussing, mi cielo?")
+@app.post("/api/batch")
+async def batch(req: BatchReq, response: Response, user_id: Optional[str] = Depends(history_user_id)):
+    """Run several text, image and chat operations in one request.
+
+    Results come back in request order, or as NDJSON lines in completion order
+    when `stream` is true. A failing operation reports its own status and error
+    without failing the batch.
+    """
+    response.headers["X-Trace-Id"] = trace_id = new_trace_id()
+    begin_trace(trace_id)
+    async def run(index: int, operation: BatchOp) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"index": index, "id": operation.id, "op": operation.op}
+        with span("queue_wait", pool="batch"):
+            await batch_semaphore.acquire()
+        try:
+            with span("batch_op", op=operation.op, index=index):
+                if isinstance(operation, BatchTextOp):
+                    data = await card_text_result(operation.question, operation.num_cards, operation.card_index)
+                    remember("card", user_id, data["text"], reading_id=data["draw_id"], card_index=operation.card_index,
+                             card=data["card"], question=operation.question)
+                elif isinstance(operation, BatchImageOp):
+                    data = await card_image_result(operation.card, operation.reading_id)
+                else:
+                    data = await chat_reply(
+                        operation.question,
+                        operation.current_card_id,
+                        [card.model_dump() for card in operation.previous_cards],
+                        [message.model_dump() for message in operation.chat_history],
+                    )
+                    remember("chat", user_id, data["text"], reading_id=current_draw_id(operation.reading_id),
+                             card=operation.current_card_id, question=operation.question)
+            result.update(status=200, result=data)
+        except HTTPException as e:
+            result.update(status=e.status_code, error=e.detail)
+        except Exception as e:
+            logging.error("Unexpected error in batch %s operation: %s", operation.op, e, exc_info=True)
+            result.update(status=500, error="Ay caramba! The cards are being mysterious. Let's try again, mi amor.")
+        finally:
+            batch_semaphore.release()
+        return result
 
-        if current_card_id not in [card.strip() for card in TAROT_CARDS]:
-            raise CardNotFoundError(current_card_id)
+    tasks = [asyncio.create_task(run(i, operation)) for i, operation in enumerate(req.operations)]
+    if not req.stream:
+        return {"results": await asyncio.gather(*tasks)}
 
-        # Format the context for the AI
-        context = f"""{get_chat_system_prompt()}
+    async def results_as_completed():
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield orjson.dumps(await next_done) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results_as_completed(), media_type="application/x-ndjson")
+
+def require_history_enabled() -> None:
+    if history_store is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def require_history_user(user_id: Optional[str] = Depends(history_user_id)) -> str:
+    require_history_enabled()
+    if not user_id:
+        raise TarotError("Mi amor, I only remember what you ask me to. Turn on memory first.", status_code=401)
+    return user_id
+
+@app.post("/api/history/token", dependencies=[Depends(require_history_enabled)])
+async def enable_history():
+    """Turn memory on: issue the token to send as X-History-Token. Keep it secret; it is the user's identity."""
+    return {"token": issue_history_token()}
+
+@app.get("/api/history")
+async def list_history(limit: int = 20, user_id: str = Depends(require_history_user)):
+    """The user's most recent readings, newest first."""
+    return {"readings": await asyncio.to_thread(history_store.readings, user_id, max(1, min(limit, 100)))}
+
+@app.get("/api/history/{draw_id}")
+async def reading_history(draw_id: str, user_id: str = Depends(require_history_user)):
+    """Card interpretations and chat turns stored for one of the user's readings, by draw ID."""
+    entries = await asyncio.to_thread(history_store.reading, user_id, draw_id)
+    if not entries:
+        raise TarotError("Ay, mi cielo, I have no memory of that reading.", status_code=404)
+    return {"draw_id": draw_id, "entries": entries}
+
+@app.delete("/api/history")
+async def forget_history(user_id: str = Depends(require_history_user)):
+    """Erase everything remembered for the user, including entries not yet written."""
+    return {"deleted": await asyncio.to_thread(history_store.forget, user_id)}
+
+def build_chat_context(question: str, current_card_id: str, previous_cards: List[Dict[str, str]],
+                       chat_history: List[Dict[str, str]]) -> str:
+    return f"""{get_chat_system_prompt()}
 
 Current card: {current_card_id}
 
@@ -469,37 +1154,6 @@ Respond as Papi Chispa, considering:
 
 Keep your response focused primarily on the current card but weave in connections to previous cards when relevant."""
 
-        try:
-            # Call OpenAI API with the enhanced context
-            response = await client.chat.completions.create(
-                model=GPT_MODEL,
-                messages=[
-                    {"role": "system", "content": context},
-                    {"role": "user", "content": question}
-                ],
-                temperature=0.7,
-                max_tokens=300
-            )
-
-            if not response.choices or not response.choices[0].message:
-                raise OpenAIServiceError("chat response")
-
-            return {"text": response.choices[0].message.content}
-
-        except OpenAIError as e:
-            logging.error(f"OpenAI API error in chat: {str(e)}")
-            raise OpenAIServiceError("chat response")
-
-    except TarotError as e:
-        # Already formatted with Papi's voice
-        raise e
-    except Exception as e:
-        logging.error(f"Unexpected error in chat endpoint: {str(e)}")
-        raise TarotError(
-            "Ay, something mysterious is blocking our connection. Try again, mi amor.",
-            status_code=500
-        )
-
 def format_previous_cards(cards: List[Dict[str, str]]) -> str:
     if not cards:
         return "No previous cards drawn."
@@ -520,3 +1174,176 @@ def format_chat_history(history: List[Dict[str, str]]) -> str:
         formatted.append(f"{role}: {msg['content']}")
     
     return "\n".join(formatted)
+
+
+
+# --- WebSocket session channel ---
+# /ws/reading carries a whole reading over one connection. Client messages:
+#   {"type": "draw", "question": str, "spread": int}
+#   {"type": "chat", "question": str, "card_index": int}
+#   {"type": "cancel"}
+# Server messages: "drawn", "card_text", "card_image", "chat_token", "chat_done",
+# "cancelled" and "error". Cards, texts and chat history stay on the server, so
+# chat turns no longer re-upload previous_cards and chat_history.
+# A streamed chat reply fails if no token arrives for CHAT_STREAM_IDLE_SECONDS.
+CHAT_STREAM_IDLE_SECONDS = float(os.getenv("CHAT_STREAM_IDLE_SECONDS", "15"))
+
+class ReadingSession:
+    """Server-side state for one /ws/reading connection."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        # Browsers cannot set headers on a WebSocket, so the history token may also come as ?history_token=.
+        self.user_id = verify_history_token(
+            websocket.headers.get("x-history-token") or websocket.query_params.get("history_token"))
+        self.reading_id: Optional[str] = None
+        self.draw_id: Optional[str] = None
+        self.question = ""
+        self.cards: List[str] = []
+        self.texts: Dict[int, str] = {}
+        self.chat_history: List[Dict[str, str]] = []
+        self.tasks: set = set()
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, message: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(orjson.dumps(message).decode("utf-8"))
+
+    def spawn(self, coro) -> None:
+        task = asyncio.create_task(self._report_errors(coro))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _report_errors(self, coro) -> None:
+        try:
+            await coro
+        except HTTPException as e:
+            await self.send({"type": "error", "detail": e.detail})
+        except ValidationError as e:
+            await self.send({"type": "error", "detail": e.errors(include_url=False, include_context=False)})
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            logging.error("Unexpected error in reading session: %s", e, exc_info=True)
+            await self.send({"type": "error", "detail": "Ay, something mysterious is blocking our connection. Try again, mi amor."})
+
+    def cancel(self) -> int:
+        """Cancel in-flight work for this session.
+
+        Speculative generation is left alone: the reading ID comes from the question
+        and spread, so other clients may share it. Abandoned readings are reaped.
+        """
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+
+async def ws_draw(session: ReadingSession, message: Dict[str, Any]) -> None:
+    req = ReadingReq(question=message.get("question", ""), spread=message.get("spread", 3))
+    session.reading_id = make_reading_id(req.question, req.spread)
+    begin_trace(new_trace_id(), session.reading_id)
+    draw = get_reading_draw(req.question, req.spread)
+    cards = draw["cards"]
+    session.question, session.cards, session.draw_id = req.question, cards, draw["draw_id"]
+    session.texts, session.chat_history = {}, []
+    await session.send({"type": "drawn", "reading_id": session.reading_id, "draw_id": session.draw_id, "cards": cards})
+
+    async def push_text(index: int, card: str) -> None:
+        text = await get_card_text(session.reading_id, card, req.question, req.spread, index)
+        session.texts[index] = text
+        remember("card", session.user_id, text, reading_id=session.draw_id, card_index=index, card=card, question=req.question)
+        await session.send({"type": "card_text", "index": index, "card": card, "text": text})
+
+    async def push_image(index: int, card: str) -> None:
+        image_url = await get_card_image_url(card, session.reading_id)
+        await session.send({"type": "card_image", "index": index, "card": card, "imageUrl": image_url})
+
+    for index, card in enumerate(cards):
+        session.spawn(push_text(index, card))
+        session.spawn(push_image(index, card))
+
+
+async def ws_chat(session: ReadingSession, message: Dict[str, Any]) -> None:
+    req = SessionChatReq.model_validate({k: message[k] for k in ("question", "card_index") if k in message})
+    question, card_index = req.question, req.card_index
+    if not session.cards:
+        raise TarotError("Draw your cards first, mi cielo.")
+    if card_index >= len(session.cards):
+        raise TarotError("Which card are we discussing, mi cielo?")
+
+    card_id = session.cards[card_index]
+    begin_trace(new_trace_id(), session.reading_id)
+    previous_cards = [{"id": card, "text": session.texts.get(i, "")} for i, card in enumerate(session.cards[:card_index])]
+    context = build_chat_context(question, card_id, previous_cards, session.chat_history)
+    messages = [
+        {"role": "system", "content": context},
+        {"role": "user", "content": question}
+    ]
+    model = model_router.select("chat", spread=len(session.cards), prompt_tokens=estimate_tokens(context, question))
+
+    parts: List[str] = []
+    degraded = False
+
+    async def stream_reply() -> None:
+        stream = await client.chat.completions.create(
+            model=model, messages=messages, temperature=0.7, max_tokens=300, stream=True,
+        )
+        chunks = stream.__aiter__()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout=CHAT_STREAM_IDLE_SECONDS)
+            except StopAsyncIteration:
+                return
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                parts.append(token)
+                await session.send({"type": "chat_token", "card_index": card_index, "token": token})
+
+    try:
+        # The whole stream runs under the breaker, so its timeout covers every token
+        # and stalls or upstream errors mid-stream count against the chat circuit.
+        with span("upstream", route="chat", model=model, stream=True), model_router.observe("chat", model):
+            await breakers["chat"].call(stream_reply)
+    except CircuitOpenError:
+        logging.info("Chat circuit open, serving templated chat reply over websocket")
+        parts, degraded = [get_fallback_chat_text(card_id)], True
+        await session.send({"type": "chat_token", "card_index": card_index, "token": parts[0]})
+    except (OpenAIError, asyncio.TimeoutError) as e:
+        logging.error("OpenAI API error in websocket chat: %r", e)
+        raise OpenAIServiceError("chat response")
+
+    text = "".join(parts)
+    session.chat_history += [{"role": "user", "content": question}, {"role": "assistant", "content": text}]
+    # Same bound /api/chat enforces on uploaded history; every turn resends it in the prompt.
+    del session.chat_history[:-CHAT_HISTORY_MAX_MESSAGES]
+    remember("chat", session.user_id, text, reading_id=session.draw_id, card=card_id, question=question)
+    await session.send({"type": "chat_done", "card_index": card_index, "text": text, "degraded": degraded})
+
+
+@app.websocket("/ws/reading")
+async def reading_socket(websocket: WebSocket):
+    """Carry a full reading (draw, card texts and images, streamed chat) over one connection."""
+    await websocket.accept()
+    session = ReadingSession(websocket)
+    try:
+        while True:
+            try:
+                message = await websocket.receive_json()
+            except (KeyError, ValueError):  # KeyError: a binary frame has no "text".
+                await session.send({"type": "error", "detail": "Mi amor, I could not understand that message."})
+                continue
+            kind = message.get("type") if isinstance(message, dict) else None
+            if kind == "draw":
+                session.cancel()
+                session.spawn(ws_draw(session, message))
+            elif kind == "chat":
+                session.spawn(ws_chat(session, message))
+            elif kind == "cancel":
+                await session.send({"type": "cancelled", "tasks": session.cancel()})
+            else:
+                await session.send({"type": "error", "detail": f"Unknown message type: {kind!r}"})
+    except WebSocketDisconnect:
+        logging.info("Reading websocket closed for reading %s", session.reading_id)
+    finally:
+        session.cancel()
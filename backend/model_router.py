@@ -0,0 +1,245 @@
+# backend/model_router.py
+"""
+Latency/cost-aware model routing for OpenAI calls.
+
+Each call names a route ("card_text", "chat", "image", "health"). The route's
+policy picks a model from the call's context (spread size, card index, prompt
+size) and the current load (in-flight calls on the route), and downgrades to
+the route's fallback model while the chosen model is missing its latency SLO.
+Policies are plain dicts so they can be overridden from a JSON file, e.g.:
+
+    {
+      "routes": {
+        "chat": {
+          "default": "gpt-4", "fallback": "gpt-3.5-turbo", "slo_seconds": 8,
+          "rules": [{"when": {"queue_depth_gte": 4}, "model": "gpt-3.5-turbo"}]
+        }
+      },
+      "costs": {"gpt-4": {"input_per_1k": 0.03, "output_per_1k": 0.06}}
+    }
+
+Overrides are validated when loaded; a route whose policy is invalid (e.g. an
+unknown rule condition) is logged and keeps its default policy.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from resilience import LatencyTracker
+
+# Approximate list prices in USD, used only for the cost estimates in /metrics.
+DEFAULT_MODEL_COSTS: Dict[str, Dict[str, float]] = {
+    "gpt-4": {"input_per_1k": 0.03, "output_per_1k": 0.06},
+    "gpt-4o": {"input_per_1k": 0.005, "output_per_1k": 0.015},
+    "gpt-4o-mini": {"input_per_1k": 0.00015, "output_per_1k": 0.0006},
+    "gpt-3.5-turbo": {"input_per_1k": 0.0005, "output_per_1k": 0.0015},
+    "dall-e-3": {"per_call": 0.04},
+}
+
+# Rule conditions understood by ModelRouter.select, keyed by the context value they test.
+_CONDITIONS = {
+    "spread_gte": ("spread", lambda value, limit: value >= limit),
+    "spread_lte": ("spread", lambda value, limit: value <= limit),
+    "card_index_gte": ("card_index", lambda value, limit: value >= limit),
+    "card_index_lte": ("card_index", lambda value, limit: value <= limit),
+    "prompt_tokens_gte": ("prompt_tokens", lambda value, limit: value >= limit),
+    "queue_depth_gte": ("queue_depth", lambda value, limit: value >= limit),
+}
+
+
+def default_routing_policies(premium_model: str, fast_model: str, image_model: str) -> Dict[str, Dict[str, Any]]:
+    """Premium model for the first card and quiet chat; fast model for the rest under load."""
+    return {
+        "card_text": {
+            "default": premium_model,
+            "fallback": fast_model,
+            "hedge_model": fast_model,
+            "slo_seconds": 15.0,
+            "rules": [
+                {"when": {"card_index_lte": 0}, "model": premium_model},
+                {"when": {"queue_depth_gte": 12}, "model": fast_model},
+                {"when": {"spread_gte": 5, "queue_depth_gte": 6}, "model": fast_model},
+            ],
+        },
+        "chat": {
+            "default": premium_model,
+            "fallback": fast_model,
+            "hedge_model": fast_model,
+            "slo_seconds": 10.0,
+            "rules": [
+                {"when": {"queue_depth_gte": 6}, "model": fast_model},
+                {"when": {"prompt_tokens_gte": 6000}, "model": fast_model},
+            ],
+        },
+        "image": {"default": image_model},
+        "health": {"default": fast_model},
+    }
+
+
+def load_routing_config(path: Optional[str], policies: Dict[str, Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, Dict[str, float]]]:
+    """Overlay the JSON routing config at `path` (if any) on the given default policies."""
+    policies = {route: dict(policy) for route, policy in policies.items()}
+    costs = dict(DEFAULT_MODEL_COSTS)
+    if not path:
+        return policies, costs
+    try:
+        with open(path) as f:
+            config = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error("Could not load model routing config from %s: %s", path, e)
+        return policies, costs
+    routes = config.get("routes", {}) if isinstance(config, dict) else None
+    if not isinstance(routes, dict):
+        logging.error("Ignoring model routing config from %s: expected an object with a \"routes\" object", path)
+        return policies, costs
+    loaded = []
+    for route, overrides in routes.items():
+        policy = {**policies.get(route, {}), **overrides} if isinstance(overrides, dict) else overrides
+        problem = _policy_error(policy)
+        if problem:
+            # A bad policy would make every select() for the route raise; keep the default instead.
+            logging.error("Ignoring model routing config for route %s from %s: %s", route, path, problem)
+            continue
+        policies[route] = policy
+        loaded.append(route)
+    if isinstance(config.get("costs"), dict):
+        costs.update(config["costs"])
+    logging.info("Loaded model routing config from %s for routes: %s", path, sorted(loaded))
+    return policies, costs
+
+
+def _policy_error(policy: Any) -> Optional[str]:
+    """Why `policy` is not a usable route policy, or None if it is."""
+    if not isinstance(policy, dict):
+        return "policy must be an object"
+    if not isinstance(policy.get("default"), str) or not policy["default"]:
+        return "\"default\" must name a model"
+    for key in ("fallback", "hedge_model"):
+        if policy.get(key) is not None and not isinstance(policy[key], str):
+            return f"\"{key}\" must name a model"
+    slo = policy.get("slo_seconds")
+    if slo is not None and (isinstance(slo, bool) or not isinstance(slo, (int, float))):
+        return "\"slo_seconds\" must be a number"
+    rules = policy.get("rules", [])
+    if not isinstance(rules, list):
+        return "\"rules\" must be a list"
+    for index, rule in enumerate(rules):
+        if not isinstance(rule, dict) or not isinstance(rule.get("model"), str) or not isinstance(rule.get("when", {}), dict):
+            return f"rule {index} must be an object with a \"model\" and a \"when\" object"
+        for name, limit in rule.get("when", {}).items():
+            if name not in _CONDITIONS:
+                return f"rule {index} has unknown condition {name!r} (expected one of {', '.join(sorted(_CONDITIONS))})"
+            if isinstance(limit, bool) or not isinstance(limit, (int, float)):
+                return f"rule {index} condition {name!r} needs a number"
+    return None
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Cheap token estimate (~4 characters per token) for routing decisions."""
+    return sum(len(t) for t in texts if t) // 4
+
+
+class CallObservation:
+    """Handle yielded by ModelRouter.observe; set `usage` from the OpenAI response."""
+    def __init__(self) -> None:
+        self.usage: Any = None
+
+
+class ModelRouter:
+    """Selects a model per call and keeps per route/model latency and cost stats."""
+
+    def __init__(self, policies: Dict[str, Dict[str, Any]], costs: Optional[Dict[str, Dict[str, float]]] = None,
+                 slo_probe_every: int = 10):
+        self.policies = policies
+        self.costs = costs if costs is not None else dict(DEFAULT_MODEL_COSTS)
+        self.slo_probe_every = slo_probe_every
+        self.latency = LatencyTracker()
+        self.in_flight: Dict[str, int] = defaultdict(int)
+        self._stats: Dict[Tuple[str, str], Dict[str, float]] = defaultdict(
+            lambda: {"calls": 0, "errors": 0, "cancelled": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0}
+        )
+        self._slo_downgrades: Dict[str, int] = defaultdict(int)
+
+    def select(self, route: str, spread: int = 0, card_index: int = 0, prompt_tokens: int = 0) -> str:
+        policy = self.policies[route]
+        context = {
+            "spread": spread,
+            "card_index": card_index,
+            "prompt_tokens": prompt_tokens,
+            "queue_depth": self.in_flight[route],
+        }
+        model = policy["default"]
+        for rule in policy.get("rules", []):
+            if all(_CONDITIONS[name][1](context[_CONDITIONS[name][0]], limit)
+                   for name, limit in rule.get("when", {}).items()):
+                model = rule["model"]
+                break
+
+        fallback = policy.get("fallback")
+        slo = policy.get("slo_seconds")
+        if fallback and slo and model != fallback:
+            p95 = self.latency.percentile(f"{route}:{model}", 95)
+            if p95 is not None and p95 > slo:
+                # Let every Nth call through so the model can show it has recovered.
+                self._slo_downgrades[route] += 1
+                if self._slo_downgrades[route] % self.slo_probe_every:
+                    return fallback
+        return model
+
+    def hedge_model(self, route: str, model: str) -> str:
+        return self.policies[route].get("hedge_model") or model
+
+    @contextmanager
+    def observe(self, route: str, model: str) -> Iterator[CallObservation]:
+        """Track an in-flight upstream call for queue depth, latency and cost stats."""
+        observation = CallObservation()
+        stats = self._stats[(route, model)]
+        self.in_flight[route] += 1
+        start = perf_counter()
+        try:
+            yield observation
+        except asyncio.CancelledError:
+            # Hedge loser or adaptive deadline: the call took at least this long, and
+            # those slow calls are exactly what the SLO downgrade has to see.
+            stats["cancelled"] += 1
+            self.latency.record(f"{route}:{model}", perf_counter() - start)
+            raise
+        except Exception:
+            stats["errors"] += 1
+            raise
+        else:
+            self.latency.record(f"{route}:{model}", perf_counter() - start)
+            self._record_cost(stats, model, observation.usage)
+        finally:
+            self.in_flight[route] -= 1
+            stats["calls"] += 1
+
+    def _record_cost(self, stats: Dict[str, float], model: str, usage: Any) -> None:
+        prices = self.costs.get(model, {})
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        if "per_call" in prices:
+            stats["cost_usd"] += prices["per_call"]
+        else:
+            stats["cost_usd"] += (prompt_tokens * prices.get("input_per_1k", 0.0)
+                                  + completion_tokens * prices.get("output_per_1k", 0.0)) / 1000
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "in_flight": dict(self.in_flight),
+            "slo_downgrades": dict(self._slo_downgrades),
+            "routes": {
+                f"{route}:{model}": {
+                    **{k: round(v, 6) if isinstance(v, float) else v for k, v in stats.items()},
+                    "p50": self.latency.percentile(f"{route}:{model}", 50),
+                    "p95": self.latency.percentile(f"{route}:{model}", 95),
+                }
+                for (route, model), stats in self._stats.items()
+            },
+        }
@@ -105,4 +105,21 @@ Use these signature phrases naturally (don't overuse):
 Remember these boundaries:
 {', '.join(ethos['boundaries'])}
 
-Speak primarily in {persona['language']['primary']} but naturally weave in {persona['language']['secondary']} terms of endearment and emotional expressions.""" 
\ No newline at end of file
+Speak primarily in {persona['language']['primary']} but naturally weave in {persona['language']['secondary']} terms of endearment and emotional expressions.""" 
+
+# The leading signature phrases are terms of endearment; the rest are UI prompts.
+ENDEARMENT_PHRASE_COUNT = 5
+
+def get_fallback_card_text(card_name: str, card_number: int = 0, total_cards: int = 1):
+    """Returns a locally templated card reading, used while OpenAI is unavailable."""
+    endearments = PAPI_PERSONA["persona"]["signature_phrases"][:ENDEARMENT_PHRASE_COUNT]
+    opener = endearments[card_number % len(endearments)].capitalize()
+    return (f"{opener}... {card_name} steps out of the shadows as card {card_number + 1} of {total_cards}. "
+            f"The spirits are whispering softly tonight, so let this card sit with you: "
+            f"what in your question does {card_name} make your heart burn to answer? "
+            f"We will look deeper when the veil lifts, mi amor.")
+
+def get_fallback_chat_text(card_id: str):
+    """Returns a locally templated chat reply, used while OpenAI is unavailable."""
+    return (f"Ay, cariño, the spirits are catching their breath right now. Hold {card_id} close "
+            f"and feel what it stirs in you... ask me again in a moment and I will tell you everything.")
@@ -0,0 +1,105 @@
+# backend/profiler.py
+"""
+On-demand sampling profiler for a live worker.
+
+profile() runs in a background thread while the event loop keeps serving
+traffic. Every `interval` seconds it walks the stacks of all other threads
+via sys._current_frames() and counts each stack, producing the "collapsed"
+format used by flamegraph.pl and speedscope (`frame;frame;frame count`).
+Optionally it also records tracemalloc statistics for the same window to
+show where the prompt-building and response paths allocate.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running."""
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename).rsplit('.', 1)[0]}:{code.co_name}"
+
+
+def _collapse(frame: Any, thread_name: str) -> str:
+    labels: List[str] = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.append(thread_name)
+    return ";".join(reversed(labels))
+
+
+def _memory_top(snapshot: tracemalloc.Snapshot, baseline: Optional[tracemalloc.Snapshot], limit: int) -> List[Dict[str, Any]]:
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    stats = snapshot.compare_to(baseline, "lineno") if baseline else snapshot.statistics("lineno")
+    top = []
+    for stat in stats[:limit]:
+        frame = stat.traceback[0]
+        top.append({
+            "location": f"{frame.filename}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "size_diff_kb": round(getattr(stat, "size_diff", 0) / 1024, 1),
+            "count": stat.count,
+        })
+    return top
+
+
+def profile(seconds: float, interval: float = 0.005, memory: bool = False, memory_top: int = 25) -> Dict[str, Any]:
+    """Sample all threads for `seconds`. Blocking: call it from a worker thread.
+
+    Raises ProfilerBusyError if another profile is already running in this process.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running on this worker")
+    started_tracemalloc = False
+    try:
+        baseline = None
+        if memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                started_tracemalloc = True
+            else:
+                baseline = tracemalloc.take_snapshot()
+
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        stacks: Counter = Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != me:
+                    stacks[_collapse(frame, names.get(thread_id) or f"thread-{thread_id}")] += 1
+            samples += 1
+            time.sleep(interval)
+
+        result: Dict[str, Any] = {
+            "seconds": seconds,
+            "interval_ms": interval * 1000,
+            "samples": samples,
+            "stacks": stacks,
+        }
+        if memory:
+            result["memory"] = _memory_top(tracemalloc.take_snapshot(), baseline, memory_top)
+        return result
+    finally:
+        if started_tracemalloc:
+            tracemalloc.stop()
+        _profile_lock.release()
+
+
+def collapsed(stacks: Counter) -> str:
+    """Render stack counts in flamegraph collapsed format."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,339 @@
+# backend/resilience.py
+"""
+Resilience helpers for upstream (OpenAI) calls.
+
+A CircuitBreaker guards one upstream operation (e.g. "chat" or "image"). It
+trips open when the recent error rate or slow-call rate crosses a threshold,
+fails fast while open so handlers can serve degraded results, and lets a few
+probe calls through once the cool-down expires (half-open) to decide whether
+the upstream has recovered.
+
+A Hedger cuts tail latency: it derives per-operation deadlines from rolling
+latency percentiles, fires one duplicate ("hedge") when a call outlives its
+p95, keeps whichever finishes first and cancels the other. Hedges are paid for
+from a global HedgeBudget so they cannot multiply load during an outage.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, TypeVar
+
+from openai import APIConnectionError, APIStatusError
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because its circuit breaker is open."""
+    def __init__(self, name: str):
+        super().__init__(f"Circuit breaker '{name}' is open")
+        self.name = name
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """True for errors that say the upstream is unhealthy: timeouts, connection
+    errors, 429s and 5xx. Other 4xx (bad prompts, content-policy rejections)
+    are the caller's problem and must not trip the breaker for everyone."""
+    if isinstance(exc, (asyncio.TimeoutError, APIConnectionError)):
+        return True
+    if isinstance(exc, APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Error-rate and latency based circuit breaker for a single upstream operation."""
+
+    def __init__(
+        self,
+        name: str,
+        window_size: int = 20,
+        min_calls: int = 5,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 20.0,
+        slow_rate_threshold: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+        call_timeout: float = 60.0,
+        is_failure: Callable[[BaseException], bool] = is_upstream_failure,
+    ):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_rate_threshold = slow_rate_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.call_timeout = call_timeout
+        self.is_failure = is_failure
+
+        self.state = CLOSED
+        self._window: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)  # (failed, slow)
+        self._opened_at = 0.0
+        self._half_open_in_flight = 0
+
+        # Counters exposed through /metrics
+        self.total_calls = 0
+        self.total_failures = 0
+        self.total_slow_calls = 0
+        self.total_rejected = 0
+        self.times_opened = 0
+
+    # --- State transitions ---
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logging.warning("Circuit breaker '%s' %s -> %s", self.name, self.state, state)
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.times_opened += 1
+        elif state == CLOSED:
+            self._window.clear()
+        self._half_open_in_flight = 0
+
+    def allow_request(self) -> bool:
+        """Return True if a call may proceed, reserving a probe slot when half-open."""
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.open_seconds:
+                self.total_rejected += 1
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._half_open_in_flight >= self.half_open_max_calls:
+                self.total_rejected += 1
+                return False
+            self._half_open_in_flight += 1
+        return True
+
+    def record(self, failed: bool, elapsed: float) -> None:
+        slow = elapsed >= self.slow_call_seconds
+        self.total_calls += 1
+        self.total_failures += int(failed)
+        self.total_slow_calls += int(slow)
+
+        if self.state == HALF_OPEN:
+            self._transition(OPEN if (failed or slow) else CLOSED)
+            return
+
+        self._window.append((failed, slow))
+        if len(self._window) < self.min_calls:
+            return
+        failure_rate = sum(f for f, _ in self._window) / len(self._window)
+        slow_rate = sum(s for _, s in self._window) / len(self._window)
+        if failure_rate >= self.failure_rate_threshold or slow_rate >= self.slow_rate_threshold:
+            self._transition(OPEN)
+
+    def _release_probe(self) -> None:
+        if self.state == HALF_OPEN and self._half_open_in_flight > 0:
+            self._half_open_in_flight -= 1
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN and time.monotonic() - self._opened_at < self.open_seconds
+
+    async def call(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Run `func()` under the breaker, enforcing `call_timeout`.
+
+        Raises CircuitOpenError without calling `func` while the breaker is open.
+        Exceptions are re-raised; only those `is_failure` accepts count as failures.
+        """
+        if not self.allow_request():
+            raise CircuitOpenError(self.name)
+        start = time.monotonic()
+        try:
+            result = await asyncio.wait_for(func(), timeout=self.call_timeout)
+        except asyncio.CancelledError:
+            # The caller gave up (hedge loser or adaptive deadline). That only says
+            # something about upstream health if the call had already run slow.
+            elapsed = time.monotonic() - start
+            if elapsed >= self.slow_call_seconds:
+                self.record(False, elapsed)
+            else:
+                self._release_probe()
+            raise
+        except Exception as e:
+            if self.is_failure(e):
+                self.record(True, time.monotonic() - start)
+            else:
+                self._release_probe()
+            raise
+        self.record(False, time.monotonic() - start)
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        window = list(self._window)
+        return {
+            "state": OPEN if self.is_open else (HALF_OPEN if self.state == OPEN else self.state),
+            "window_calls": len(window),
+            "window_failure_rate": round(sum(f for f, _ in window) / len(window), 3) if window else 0.0,
+            "window_slow_rate": round(sum(s for _, s in window) / len(window), 3) if window else 0.0,
+            "total_calls": self.total_calls,
+            "total_failures": self.total_failures,
+            "total_slow_calls": self.total_slow_calls,
+            "total_rejected": self.total_rejected,
+            "times_opened": self.times_opened,
+        }
+
+
+class LatencyTracker:
+    """Rolling window of recent upstream latencies per operation."""
+
+    def __init__(self, window_size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=window_size))
+
+    def record(self, op: str, seconds: float) -> None:
+        self._samples[op].append(seconds)
+
+    def percentile(self, op: str, p: float) -> Optional[float]:
+        """Return the p-th percentile (0-100), or None until enough samples exist."""
+        samples = self._samples.get(op)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            op: {
+                "samples": len(samples),
+                "p50": self.percentile(op, 50),
+                "p95": self.percentile(op, 95),
+                "p99": self.percentile(op, 99),
+            }
+            for op, samples in self._samples.items()
+        }
+
+
+class HedgeBudget:
+    """Token bucket shared by all operations: each primary call earns `ratio`
+    tokens and each hedge spends one, capping hedges to ~ratio of traffic."""
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def earn(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        if self.tokens < 1.0:
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class Hedger:
+    """Runs upstream calls with adaptive deadlines and a single hedged duplicate."""
+
+    def __init__(
+        self,
+        tracker: LatencyTracker,
+        budget: HedgeBudget,
+        hedge_percentile: float = 95,
+        deadline_percentile: float = 99,
+        deadline_multiplier: float = 2.0,
+        min_hedge_delay: float = 1.0,
+    ):
+        self.tracker = tracker
+        self.budget = budget
+        self.hedge_percentile = hedge_percentile
+        self.deadline_percentile = deadline_percentile
+        self.deadline_multiplier = deadline_multiplier
+        self.min_hedge_delay = min_hedge_delay
+        self.hedges_fired: Dict[str, int] = defaultdict(int)
+        self.hedges_won: Dict[str, int] = defaultdict(int)
+        self.hedges_denied: Dict[str, int] = defaultdict(int)
+        self.deadlines_exceeded: Dict[str, int] = defaultdict(int)
+
+    def hedge_delay(self, op: str, default: float) -> float:
+        observed = self.tracker.percentile(op, self.hedge_percentile)
+        return max(self.min_hedge_delay, observed if observed is not None else default)
+
+    def deadline(self, op: str, min_deadline: float, max_deadline: float) -> float:
+        observed = self.tracker.percentile(op, self.deadline_percentile)
+        if observed is None:
+            return max_deadline
+        return min(max_deadline, max(min_deadline, observed * self.deadline_multiplier))
+
+    async def run(
+        self,
+        op: str,
+        primary: Callable[[], Awaitable[T]],
+        hedge: Optional[Callable[[], Awaitable[T]]] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        default_hedge_delay: float = 10.0,
+        min_deadline: float = 15.0,
+        max_deadline: float = 60.0,
+    ) -> T:
+        """Await `primary()`, hedging with `hedge()` (or `primary()` again) past p95.
+
+        Raises asyncio.TimeoutError once the adaptive deadline expires, and the
+        last attempt's exception if every attempt fails.
+        """
+        self.budget.earn()
+        hedge = hedge or primary
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        hedge_at = self.hedge_delay(op, default_hedge_delay)
+        deadline = self.deadline(op, min_deadline, max_deadline)
+
+        primary_task = asyncio.ensure_future(primary())
+        tasks = {primary_task}
+        hedged = False
+        completed = False
+        last_exc: Optional[BaseException] = None
+        try:
+            while tasks:
+                elapsed = loop.time() - start
+                if elapsed >= deadline:
+                    self.deadlines_exceeded[op] += 1
+                    raise asyncio.TimeoutError(f"{op} exceeded adaptive deadline of {deadline:.1f}s")
+                timeout = deadline - elapsed
+                if not hedged:
+                    timeout = min(timeout, max(0.0, hedge_at - elapsed))
+
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is None:
+                        # Latency of the operation as the caller saw it, hedge or not.
+                        self.tracker.record(op, loop.time() - start)
+                        completed = True
+                        if task is not primary_task:
+                            self.hedges_won[op] += 1
+                        return task.result()
+                    last_exc = task.exception()
+
+                if not done and not hedged and loop.time() - start >= hedge_at:
+                    hedged = True
+                    if (breaker is None or breaker.state == CLOSED) and self.budget.try_acquire():
+                        self.hedges_fired[op] += 1
+                        logging.info("Hedging %s call after %.2fs", op, hedge_at)
+                        tasks.add(asyncio.ensure_future(hedge()))
+                    else:
+                        self.hedges_denied[op] += 1
+            raise last_exc  # type: ignore[misc]
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks and not completed:
+                # Censored sample at the deadline: the operation took at least this long.
+                self.tracker.record(op, loop.time() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "latency": self.tracker.snapshot(),
+            "hedge_budget_tokens": round(self.budget.tokens, 2),
+            "hedges_fired": dict(self.hedges_fired),
+            "hedges_won": dict(self.hedges_won),
+            "hedges_denied": dict(self.hedges_denied),
+            "deadlines_exceeded": dict(self.deadlines_exceeded),
+        }
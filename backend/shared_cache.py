@@ -0,0 +1,170 @@
+# backend/shared_cache.py
+"""
+Node-local cache shared by every worker process.
+
+Gunicorn runs several uvicorn workers per node; per-process dicts meant each
+worker drew its own cards for the same question and regenerated content
+another worker already had. SharedCache keeps those entries in one SQLite
+database in WAL mode (readers never block the writer) with the file
+memory-mapped, so lookups read straight from the shared OS page cache and
+node memory does not grow with the worker count.
+
+Values are JSON-encoded and grouped by namespace with a per-entry TTL.
+Lookups are single indexed reads on a local file and are cheap enough to run
+on the event loop. Writes only wait `busy_timeout` seconds for another
+worker's write lock; on contention the cache degrades to a miss (or a
+skipped write) rather than stalling the event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID
+"""
+
+
+def default_cache_path() -> str:
+    """Prefer tmpfs so the cache never touches disk; fall back to the temp dir."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "papi-chispa-cache.sqlite3")
+
+
+class SharedCache:
+    """Cross-worker key/value cache backed by a memory-mapped SQLite WAL database."""
+
+    def __init__(self, path: str, default_ttl: float = 3600.0, mmap_bytes: int = 64 * 1024 * 1024,
+                 purge_every: int = 500, busy_timeout: float = 0.05):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.default_ttl = default_ttl
+        self.mmap_bytes = mmap_bytes
+        self.purge_every = purge_every
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock_errors = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # One connection per process: a connection inherited across fork() must not be reused.
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            conn.execute(_SCHEMA)
+            self._conn, self._pid = conn, os.getpid()
+            logging.info("Opened shared cache at %s (pid %s)", self.path, self._pid)
+        return self._conn
+
+    def _contended(self, operation: str, error: sqlite3.OperationalError) -> None:
+        self.lock_errors += 1
+        logging.warning("Shared cache %s skipped: %s", operation, error)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            self._contended("read", e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        try:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time() + (self.default_ttl if ttl is None else ttl)),
+            )
+        except sqlite3.OperationalError as e:
+            self._contended("write", e)
+            return
+        self._after_write()
+
+    def add(self, namespace: str, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Store `value` only if no live entry exists. Returns True if this call stored it.
+
+        Returns False without storing if the write lock could not be taken in time.
+        """
+        now = time.time()
+        try:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as e:
+            self._contended("add", e)
+            return False
+        try:
+            conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ? AND expires_at <= ?", (namespace, key, now))
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), now + (self.default_ttl if ttl is None else ttl)),
+            ).rowcount == 1
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._after_write()
+        return inserted
+
+    def delete(self, namespace: str, key: str) -> None:
+        try:
+            self.conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+        except sqlite3.OperationalError as e:
+            self._contended("delete", e)
+
+    async def wait_for(self, namespace: str, key: str, timeout: float, interval: float = 0.1,
+                       give_up: Optional[Callable[[], bool]] = None) -> Optional[Any]:
+        """Poll for an entry another worker is expected to write, up to `timeout` seconds.
+
+        Stops early, returning None, as soon as `give_up()` is true.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            value = self.get(namespace, key)
+            if value is not None or time.monotonic() >= deadline or (give_up is not None and give_up()):
+                return value
+            await asyncio.sleep(interval)
+
+    def _after_write(self) -> None:
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge_expired()
+
+    def purge_expired(self) -> int:
+        try:
+            return self.conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+        except sqlite3.OperationalError as e:
+            self._contended("purge", e)
+            return 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        rows = self.conn.execute(
+            "SELECT namespace, COUNT(*) FROM cache WHERE expires_at > ? GROUP BY namespace", (time.time(),)
+        ).fetchall()
+        return {
+            "path": self.path,
+            "entries": dict(rows),
+            "hits": self.hits,
+            "misses": self.misses,
+            "lock_errors": self.lock_errors,
+        }
@@ -0,0 +1,205 @@
+# backend/speculation.py
+"""
+Speculative background generation for drawn readings.
+
+As soon as a spread is sampled, every card's text and image is scheduled in
+the background so that the later /api/reading/text and /api/reading/image
+calls can be answered from prepared results. Generators signal failure by
+raising, so a failed task is simply a miss. Readings nobody touches for
+`idle_timeout` seconds are treated as abandoned and their pending work is
+cancelled by a reaper task that runs while any reading is held.
+
+Speculative tasks share a `concurrency`-wide queue across readings. A caller
+only waits on a task that is already running; one still queued is cancelled
+and the caller generates the result itself, so on-demand requests never wait
+behind other readings' speculative work.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from tracing import span
+
+
+class PreparedReading:
+    """Background generation tasks for one drawn reading."""
+
+    def __init__(self, reading_id: str, question: str, cards: List[str]):
+        self.reading_id = reading_id
+        self.question = question
+        self.cards = cards
+        self.texts: Dict[int, "asyncio.Task[str]"] = {}
+        self.images: Dict[int, "asyncio.Task[str]"] = {}
+        self.last_access = time.monotonic()
+
+    def tasks(self) -> List["asyncio.Task[str]"]:
+        return list(self.texts.values()) + list(self.images.values())
+
+    def cancel(self) -> int:
+        pending = [t for t in self.tasks() if not t.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+
+class SpeculativeStore:
+    """Schedules and serves speculative card texts and images, keyed by reading ID."""
+
+    def __init__(self, idle_timeout: float = 300.0, max_readings: int = 200, concurrency: int = 8):
+        self.idle_timeout = idle_timeout
+        self.max_readings = max_readings
+        self._readings: "OrderedDict[str, PreparedReading]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._concurrency = concurrency
+        self._reaper: Optional["asyncio.Task[None]"] = None
+        # Tasks holding the semaphore, i.e. actually generating rather than queued.
+        self._running: set = set()
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+
+    async def _limited(self, coro_factory: Callable[[], Awaitable[str]]) -> str:
+        # Created lazily so the semaphore binds to the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        with span("queue_wait", pool="speculative"):
+            await self._semaphore.acquire()
+        task = asyncio.current_task()
+        self._running.add(task)
+        try:
+            return await coro_factory()
+        finally:
+            self._running.discard(task)
+            self._semaphore.release()
+
+    def schedule(
+        self,
+        reading_id: str,
+        question: str,
+        cards: List[str],
+        make_text: Callable[[str, int], Awaitable[str]],
+        make_image: Callable[[str], Awaitable[str]],
+        on_finished: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Start background text and image generation for every card in the reading.
+
+        `on_finished` is called once every task has completed, failed or been cancelled.
+        """
+        self.reap()
+        if reading_id in self._readings:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Not called from the event loop; nothing to schedule onto.
+
+        reading = PreparedReading(reading_id, question, cards)
+        for index, card in enumerate(cards):
+            reading.texts[index] = loop.create_task(self._limited(lambda c=card, i=index: make_text(c, i)))
+            reading.images[index] = loop.create_task(self._limited(lambda c=card: make_image(c)))
+        remaining = len(reading.tasks())
+
+        def task_done(task: "asyncio.Task[str]") -> None:
+            nonlocal remaining
+            _consume_exception(task)
+            remaining -= 1
+            if remaining == 0 and on_finished is not None:
+                on_finished()
+
+        for task in reading.tasks():
+            task.add_done_callback(task_done)
+        self._readings[reading_id] = reading
+        if self._reaper is None or self._reaper.done():
+            self._reaper = loop.create_task(self._reap_while_held())
+        while len(self._readings) > self.max_readings:
+            _, evicted = self._readings.popitem(last=False)
+            self.cancelled += evicted.cancel()
+        logging.info("Scheduled speculative generation for reading %s (%s cards)", reading_id, len(cards))
+
+    def get(self, reading_id: str) -> Optional[PreparedReading]:
+        reading = self._readings.get(reading_id)
+        if reading is not None:
+            reading.last_access = time.monotonic()
+            self._readings.move_to_end(reading_id)
+        return reading
+
+    async def _result(self, task: Optional["asyncio.Task[str]"]) -> Optional[str]:
+        if task is None or task.cancelled():
+            self.misses += 1
+            return None
+        if not task.done() and task not in self._running:
+            await asyncio.sleep(0)  # A task scheduled this iteration gets its first step to claim a free slot.
+        if not task.done() and task not in self._running:
+            # Still queued behind other speculative work; generating now is faster than waiting.
+            task.cancel()
+            self.cancelled += 1
+            self.misses += 1
+            return None
+        try:
+            # Shield so a disconnecting client does not cancel work other requests can use.
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.cancelled():
+                self.misses += 1
+                return None
+            raise
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    async def text(self, reading_id: str, index: int) -> Optional[str]:
+        self.reap()
+        reading = self.get(reading_id)
+        return await self._result(reading.texts.get(index) if reading else None)
+
+    async def image(self, card_name: str, reading_id: Optional[str] = None) -> Optional[str]:
+        """Prepared image for `card_name`, from the given reading or any reading that drew it."""
+        self.reap()
+        candidates = [self._readings[reading_id]] if reading_id in self._readings else reversed(self._readings.values())
+        for reading in candidates:
+            if card_name in reading.cards:
+                reading.last_access = time.monotonic()
+                return await self._result(reading.images.get(reading.cards.index(card_name)))
+        self.misses += 1
+        return None
+
+    def cancel(self, reading_id: str) -> int:
+        reading = self._readings.pop(reading_id, None)
+        if reading is None:
+            return 0
+        cancelled = reading.cancel()
+        self.cancelled += cancelled
+        return cancelled
+
+    def reap(self) -> None:
+        """Cancel pending work for readings idle longer than `idle_timeout`."""
+        now = time.monotonic()
+        for reading_id in [rid for rid, r in self._readings.items() if now - r.last_access > self.idle_timeout]:
+            cancelled = self.cancel(reading_id)
+            if cancelled:
+                logging.info("Cancelled %s speculative tasks for abandoned reading %s", cancelled, reading_id)
+
+    async def _reap_while_held(self) -> None:
+        # Without this an idle worker would never cancel abandoned readings.
+        while self._readings:
+            await asyncio.sleep(max(1.0, self.idle_timeout / 4))
+            self.reap()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {
+            "readings": len(self._readings),
+            "pending_tasks": sum(1 for r in self._readings.values() for t in r.tasks() if not t.done()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+        }
+
+
+def _consume_exception(task: "asyncio.Task[str]") -> None:
+    # Failed speculation is just a miss; retrieve the exception so an unused failure is not logged.
+    if not task.cancelled():
+        task.exception()
@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+# Backend modules are imported as top-level modules (as in `uvicorn main:app`).
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
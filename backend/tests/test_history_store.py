@@ -0,0 +1,80 @@
+# backend/tests/test_history_store.py
+import pytest
+
+import history_store
+from history_store import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"), flush_interval=0.01)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(history_store.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def held_writer(store, monkeypatch):
+    """Keep entries queued until the test starts the writer."""
+    monkeypatch.setattr(store, "_start_writer", lambda: None)
+    return lambda: HistoryStore._start_writer(store)
+
+
+def test_entries_are_written_behind_and_read_back(store):
+    store.record("card", "u1", "A leap of faith", reading_id="d1", card_index=0, card="The Fool", question="Love?")
+    store.record("chat", "u1", "Trust it, mi amor", reading_id="d1", card="The Fool", question="Really?")
+    store.record("card", "u2", "Someone else's", reading_id="d1", card_index=0, card="The Star")
+    store.close()
+    entries = store.reading("u1", "d1")
+    assert [(e["kind"], e["content"]) for e in entries] == [("card", "A leap of faith"), ("chat", "Trust it, mi amor")]
+    assert store.readings("u1") == [
+        {"reading_id": "d1", "started_at": entries[0]["created_at"], "question": "Love?", "cards": 1, "chat_turns": 1}
+    ]
+    assert store.snapshot()["written"] == 3
+
+
+def test_card_is_stored_once_per_reading(store):
+    store.record("card", "u1", "first", reading_id="d1", card_index=0, card="The Fool")
+    store.record("card", "u1", "refetched", reading_id="d1", card_index=0, card="The Fool")
+    store.record("card", "u1", "next draw", reading_id="d2", card_index=0, card="The Tower")
+    store.close()
+    assert [e["content"] for e in store.reading("u1", "d1")] == ["first"]
+    assert [e["content"] for e in store.reading("u1", "d2")] == ["next draw"]
+
+
+def test_forget_drops_entries_still_queued(store, clock, held_writer):
+    store.record("card", "u1", "queued before forget", reading_id="d1", card_index=0)
+    store.record("card", "u2", "another user", reading_id="d2", card_index=0)
+    clock[0] += 1
+    assert store.forget("u1") == 0
+    clock[0] += 1
+    store.record("chat", "u1", "after forget", reading_id="d3")
+    held_writer()
+    store.close()
+    assert store.reading("u1", "d1") == []
+    assert [e["content"] for e in store.reading("u1", "d3")] == ["after forget"]
+    assert [e["content"] for e in store.reading("u2", "d2")] == ["another user"]
+
+
+def test_forget_deletes_written_entries(store):
+    store.record("card", "u1", "written", reading_id="d1", card_index=0)
+    store.close()
+    assert store.forget("u1") == 1
+    assert store.readings("u1") == []
+
+
+def test_compact_deletes_entries_past_retention(store, clock, held_writer):
+    store.record("chat", "u1", "old", reading_id="d1")
+    clock[0] += store.retention_days * 86400
+    store.record("chat", "u1", "recent", reading_id="d1")
+    held_writer()
+    store.close()
+    clock[0] += 1
+    assert store.compact() == 1
+    assert [e["content"] for e in store.reading("u1", "d1")] == ["recent"]
@@ -0,0 +1,140 @@
+# backend/tests/test_resilience.py
+import asyncio
+import types
+
+import openai
+import pytest
+
+import resilience
+from resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+def status_error(cls, status_code):
+    response = types.SimpleNamespace(status_code=status_code, headers={}, request=None)
+    return cls(f"HTTP {status_code}", response=response, body=None)
+
+
+def make_breaker(**kwargs):
+    options = dict(window_size=4, min_calls=4, failure_rate_threshold=0.5, slow_call_seconds=10.0,
+                   open_seconds=30.0, call_timeout=5.0)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def call(breaker, result=None, exc=None, delay=0.0):
+    async def func():
+        if delay:
+            await asyncio.sleep(delay)
+        if exc is not None:
+            raise exc
+        return result
+    return asyncio.run(breaker.call(func))
+
+
+def fail(breaker, exc):
+    with pytest.raises(type(exc)):
+        call(breaker, exc=exc)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_stays_closed_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        fail(breaker, status_error(openai.InternalServerError, 500))
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_failure_rate_and_rejects_calls():
+    breaker = make_breaker()
+    call(breaker, "ok")
+    call(breaker, "ok")
+    fail(breaker, status_error(openai.InternalServerError, 503))
+    fail(breaker, status_error(openai.RateLimitError, 429))
+    assert breaker.state == OPEN
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        call(breaker, "ok")
+    assert breaker.total_rejected == 1
+
+
+def test_timeouts_and_connection_errors_count_as_failures():
+    breaker = make_breaker(call_timeout=0.01)
+    for _ in range(2):
+        with pytest.raises(asyncio.TimeoutError):
+            call(breaker, "late", delay=0.1)
+    connection_error = openai.APIConnectionError(request=None)
+    fail(breaker, connection_error)
+    fail(breaker, connection_error)
+    assert breaker.state == OPEN
+    assert breaker.total_failures == 4
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    breaker = make_breaker()
+    for _ in range(8):
+        fail(breaker, status_error(openai.BadRequestError, 400))
+    fail(breaker, ValueError("bad prompt"))
+    assert breaker.state == CLOSED
+    assert breaker.total_calls == 0
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = make_breaker(min_calls=1, window_size=1)
+    fail(breaker, status_error(openai.InternalServerError, 500))
+    assert breaker.state == OPEN
+    clock[0] += 31
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()  # Only one probe at a time.
+    breaker.record(False, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = make_breaker(min_calls=1, window_size=1)
+    fail(breaker, status_error(openai.InternalServerError, 500))
+    clock[0] += 31
+    fail(breaker, status_error(openai.InternalServerError, 500))
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+
+
+def test_half_open_probe_released_by_client_error(clock):
+    breaker = make_breaker(min_calls=1, window_size=1)
+    fail(breaker, status_error(openai.InternalServerError, 500))
+    clock[0] += 31
+    fail(breaker, status_error(openai.BadRequestError, 400))
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_slow_calls_open_the_breaker():
+    breaker = make_breaker(slow_call_seconds=0.0, slow_rate_threshold=0.5)
+    for _ in range(4):
+        call(breaker, "ok")
+    assert breaker.state == OPEN
+    assert breaker.total_slow_calls == 4
+
+
+def test_hedge_win_is_timed_from_operation_start():
+    tracker = resilience.LatencyTracker(min_samples=1)
+    hedger = resilience.Hedger(tracker, resilience.HedgeBudget(), min_hedge_delay=0.05)
+
+    async def slow():
+        await asyncio.sleep(1.0)
+        return "primary"
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "hedge"
+
+    assert asyncio.run(hedger.run("chat", slow, fast, default_hedge_delay=0.05)) == "hedge"
+    samples = list(tracker._samples["chat"])
+    assert len(samples) == 1  # The cancelled primary adds no sample of its own.
+    assert samples[0] >= 0.06
@@ -0,0 +1,76 @@
+# backend/tests/test_shared_cache.py
+import asyncio
+import sqlite3
+
+import pytest
+
+import shared_cache
+from shared_cache import SharedCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SharedCache(str(tmp_path / "cache.sqlite3"), default_ttl=60.0, busy_timeout=0.01)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(shared_cache.time, "time", lambda: now[0])
+    return now
+
+
+def test_add_only_stores_the_first_value(cache):
+    assert cache.add("reading", "r1", ["The Fool"]) is True
+    assert cache.add("reading", "r1", ["The Tower"]) is False
+    assert cache.get("reading", "r1") == ["The Fool"]
+
+
+def test_add_replaces_an_expired_entry(cache, clock):
+    assert cache.add("reading", "r1", ["The Fool"], ttl=10.0) is True
+    clock[0] += 11.0
+    assert cache.get("reading", "r1") is None
+    assert cache.add("reading", "r1", ["The Tower"], ttl=10.0) is True
+    assert cache.get("reading", "r1") == ["The Tower"]
+
+
+def test_add_gives_up_when_another_worker_holds_the_write_lock(cache):
+    cache.get("reading", "warm-up")  # Open the connection before the lock is taken.
+    other = sqlite3.connect(cache.path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    try:
+        assert cache.add("reading", "r1", ["The Fool"]) is False
+        cache.set("reading", "r2", ["The Star"])  # Skipped, not raised.
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert cache.lock_errors == 2
+    assert cache.get("reading", "r1") is None
+    assert cache.add("reading", "r1", ["The Fool"]) is True
+
+
+def test_wait_for_returns_the_value_once_written(cache):
+    async def scenario():
+        waiter = asyncio.create_task(cache.wait_for("card_text", "r1:0", timeout=5.0, interval=0.01))
+        await asyncio.sleep(0.05)
+        cache.set("card_text", "r1:0", "Hola")
+        return await waiter
+    assert asyncio.run(scenario()) == "Hola"
+
+
+def test_wait_for_stops_early_when_giving_up(cache):
+    checks = []
+
+    def give_up():
+        checks.append(1)
+        return len(checks) >= 3
+
+    async def scenario():
+        return await asyncio.wait_for(
+            cache.wait_for("card_text", "r1:0", timeout=60.0, interval=0.01, give_up=give_up), timeout=1.0)
+    assert asyncio.run(scenario()) is None
+    assert len(checks) == 3
+
+
+def test_wait_for_times_out(cache):
+    assert asyncio.run(cache.wait_for("card_text", "r1:0", timeout=0.05, interval=0.01)) is None
@@ -0,0 +1,92 @@
+# backend/tests/test_speculation.py
+import asyncio
+
+from speculation import SpeculativeStore
+
+
+def generator(results, delay=0.0, fail=False):
+    async def generate(card, index=None):
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("upstream down")
+        results.append(card)
+        return f"{card} ready"
+    return generate
+
+
+def test_serves_prepared_results():
+    async def scenario():
+        store = SpeculativeStore()
+        made = []
+        store.schedule("r1", "q", ["The Fool", "The Star"], generator(made), generator(made))
+        return await store.text("r1", 1), await store.image("The Fool"), store.snapshot()
+    text, image, snapshot = asyncio.run(scenario())
+    assert (text, image) == ("The Star ready", "The Fool ready")
+    assert snapshot["hits"] == 2
+
+
+def test_failed_task_is_a_miss():
+    async def scenario():
+        store = SpeculativeStore()
+        store.schedule("r1", "q", ["The Fool"], generator([], fail=True), generator([]))
+        return await store.text("r1", 0), store.misses
+    assert asyncio.run(scenario()) == (None, 1)
+
+
+def test_queued_task_is_cancelled_instead_of_awaited():
+    async def scenario():
+        store = SpeculativeStore(concurrency=1)
+        store.schedule("r1", "q", ["The Fool"], generator([], delay=5.0), generator([], delay=5.0))
+        await asyncio.sleep(0)  # The text task takes the only slot; the image task queues.
+        reading = store.get("r1")
+        started = asyncio.get_running_loop().time()
+        image = await store.image("The Fool", "r1")
+        waited = asyncio.get_running_loop().time() - started
+        await asyncio.sleep(0)
+        result = image, waited, reading.images[0].cancelled(), reading.texts[0].done()
+        store.cancel("r1")
+        return result
+    image, waited, image_cancelled, text_done = asyncio.run(scenario())
+    assert image is None
+    assert waited < 1.0
+    assert image_cancelled
+    assert not text_done
+
+
+def test_on_finished_fires_once_all_tasks_are_done():
+    async def scenario():
+        store = SpeculativeStore()
+        finished = []
+        store.schedule("r1", "q", ["The Fool", "The Star"], generator([], fail=True), generator([], delay=0.01),
+                       on_finished=lambda: finished.append(True))
+        await asyncio.sleep(0)
+        assert finished == []
+        await asyncio.sleep(0.1)
+        return finished
+    assert asyncio.run(scenario()) == [True]
+
+
+def test_on_finished_fires_when_cancelled():
+    async def scenario():
+        store = SpeculativeStore()
+        finished = []
+        store.schedule("r1", "q", ["The Fool"], generator([], delay=5.0), generator([], delay=5.0),
+                       on_finished=lambda: finished.append(True))
+        await asyncio.sleep(0)
+        cancelled = store.cancel("r1")
+        await asyncio.sleep(0)
+        return cancelled, finished
+    assert asyncio.run(scenario()) == (2, [True])
+
+
+def test_reaper_cancels_abandoned_readings():
+    async def scenario():
+        store = SpeculativeStore(idle_timeout=0.2)
+        store.schedule("r1", "q", ["The Fool"], generator([], delay=5.0), generator([], delay=5.0))
+        reading = store.get("r1")
+        await asyncio.sleep(1.2)  # The reaper checks at most once a second.
+        return reading.tasks(), store.snapshot()
+    tasks, snapshot = asyncio.run(scenario())
+    assert all(task.cancelled() for task in tasks)
+    assert snapshot["readings"] == 0
+    assert snapshot["cancelled"] == 2
@@ -0,0 +1,160 @@
+# backend/tracing.py
+"""
+Lightweight span tracing for reading requests.
+
+A trace covers one request and is carried in a context variable, so asyncio
+tasks spawned while handling it (per-card generation, hedged attempts,
+speculative work) record their spans into the same trace. Spans also carry
+the reading ID, when there is one, so every request of a reading can be
+looked up together. Finished spans go to an in-memory ring
+buffer and, if configured, to a JSONL file written by a background thread.
+render_waterfall() turns one trace into a text waterfall for /debug/traces.
+"""
+import itertools
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+_current_trace: ContextVar[Optional[str]] = ContextVar("current_trace", default=None)
+_current_reading: ContextVar[Optional[str]] = ContextVar("current_reading", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+_buffer: Deque["Span"] = deque(maxlen=5000)
+_export_queue: Optional["queue.SimpleQueue[Optional[str]]"] = None
+
+
+class Span:
+    __slots__ = ("trace_id", "reading_id", "span_id", "parent_id", "name", "attrs", "wall_start", "start", "end", "error")
+
+    def __init__(self, trace_id: str, name: str, parent: Optional["Span"], attrs: Dict[str, Any],
+                 reading_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.reading_id = reading_id
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.attrs = attrs
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "reading_id": self.reading_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.wall_start,
+            "duration_ms": round(self.duration_ms, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+def configure(buffer_size: int = 5000, export_path: Optional[str] = None) -> None:
+    """Size the ring buffer and optionally start the JSONL exporter thread."""
+    global _buffer, _export_queue
+    _buffer = deque(_buffer, maxlen=buffer_size)
+    if export_path and _export_queue is None:
+        _export_queue = queue.SimpleQueue()
+        threading.Thread(target=_export_worker, args=(export_path, _export_queue), name="trace-exporter", daemon=True).start()
+        logging.info("Exporting trace spans to %s", export_path)
+
+
+def _export_worker(path: str, spans: "queue.SimpleQueue[Optional[str]]") -> None:
+    with open(path, "a", encoding="utf-8") as f:
+        while True:
+            line = spans.get()
+            if line is None:
+                return
+            f.write(line + "\n")
+            if spans.empty():
+                f.flush()
+
+
+def begin_trace(trace_id: str, reading_id: Optional[str] = None) -> None:
+    """Make `trace_id` the current trace for this request and the tasks it spawns."""
+    _current_trace.set(trace_id)
+    _current_reading.set(reading_id)
+    _current_span.set(None)
+
+
+def current_trace_id() -> Optional[str]:
+    return _current_trace.get()
+
+
+def current_reading_id() -> Optional[str]:
+    return _current_reading.get()
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Optional[Span]]:
+    """Record a span under the current trace; a no-op outside of a trace."""
+    trace_id = _current_trace.get()
+    if trace_id is None:
+        yield None
+        return
+    current = Span(trace_id, name, _current_span.get(), attrs, _current_reading.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+        _buffer.append(current)
+        if _export_queue is not None:
+            _export_queue.put(json.dumps(current.to_dict(), default=str))
+
+
+def get_trace(trace_id: str) -> List[Span]:
+    """Spans of one request trace, or of every request of a reading when given a reading ID."""
+    return sorted((s for s in list(_buffer) if trace_id in (s.trace_id, s.reading_id)), key=lambda s: s.start)
+
+
+def render_waterfall(spans: List[Span], width: int = 60) -> List[str]:
+    """One line per span: indented name, a bar placed on the trace timeline, and its duration."""
+    if not spans:
+        return []
+    origin = spans[0].start
+    total = max((s.end or time.perf_counter()) for s in spans) - origin or 1e-9
+    # Depth-first so each span is listed under its parent; spans whose parent has
+    # left the ring buffer are shown as roots.
+    ids = {s.span_id for s in spans}
+    children: Dict[Optional[int], List[Span]] = {}
+    for s in spans:
+        children.setdefault(s.parent_id if s.parent_id in ids else None, []).append(s)
+    rows = []
+    stack = [(s, 0) for s in reversed(children.get(None, []))]
+    while stack:
+        s, depth = stack.pop()
+        label = "  " * depth + s.name
+        if s.attrs:
+            label += " " + " ".join(f"{k}={v}" for k, v in s.attrs.items())
+        rows.append((label, s))
+        stack.extend((child, depth + 1) for child in reversed(children.get(s.span_id, [])))
+    name_width = max(len(label) for label, _ in rows)
+    lines = []
+    for label, s in rows:
+        offset = int((s.start - origin) / total * width)
+        length = max(1, int(s.duration_ms / 1000 / total * width))
+        bar = " " * offset + "#" * min(length, width - offset)
+        flag = f" !{s.error}" if s.error else ""
+        lines.append(f"{label.ljust(name_width)} |{bar.ljust(width)}| "
+                     f"+{(s.start - origin) * 1000:8.1f}ms {s.duration_ms:8.1f}ms{flag}")
+    return lines